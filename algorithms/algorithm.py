@@ -3,12 +3,21 @@ import math
 import numpy as np
 import sys
 import os
+import mmap
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib
 from matplotlib import pyplot as plt
 import subprocess
+import warnings
 import matplotlib.ticker as mticker
 from matplotlib.ticker import ScalarFormatter
 from statistics import median, mean
+from .latency_stats import LatencyStats
+from .events import InterpolatedDelay
+from .environment import SimulationEnvironment
+from .simulation_results import SimulationResults, StageAttribute
+from .profiler import StageProfiler, profiled_metric
 # from abc import ABC, abstractmethod
 
 matplotlib.rcParams['pdf.fonttype'] = 42
@@ -27,21 +36,64 @@ class Algorithm():
 	The RBs may timestamp the trades which can be used to modify the OB's ordering
 	algorithm.
 	"""
+	## Number of data points ranked together when calculating fairness.
+	FAIRNESS_CHUNK_SIZE = 1 << 13
+	## Width of the histogram bins (in us) used to estimate latency percentiles.
+	LATENCY_RESOLUTION = 0.01
+	## Implementations of the stages and metrics. "reference" uses the original pure Python loops
+	## and is kept to check the faster "numpy" implementation against (see `differential.py`).
+	BACKENDS = ("reference", "numpy")
+	## Number of trades (data points times MPs) simulated together by `run_streaming_simulation`, so that
+	## its memory grows with neither the horizon nor the number of MPs.
+	STREAM_CHUNK_TRADES = 1 << 20
+	## Number of data points beyond a chunk simulated at first to complete the trades of the chunk.
+	## It is doubled until the trades of the chunk no longer depend on later data points.
+	STREAM_LOOKAHEAD = 1 << 10
+	## Stage arrays filled by `simulate_participant`, in the order of its results (see `run_participant_stages`).
+	PARTICIPANT_ARRAYS = ()
+	## Stage arrays used by the stages which depend on all MPs, after `run_participant_stages`.
+	EXECUTION_INPUTS = ()
+	## Stage arrays kept after a simulation: "all" stages, only what the "metrics" need (the orderings
+	## of trades for fairness; latencies are kept as statistics), or "none", keeping only the fairness
+	## counts and latency statistics. Other stages are released as soon as no later stage needs them.
+	## The fairness counts need the orderings of all MPs, so even with "none" `run_simulation` holds
+	## (N, T) float64 orderings and `EXECUTION_INPUTS` until the end; use `run_streaming_simulation`
+	## to bound the memory of metrics-only runs.
+	RETENTION_POLICIES = ("all", "metrics", "none")
+
+	## Stage arrays, held by `results` (see `simulation_results.SimulationResults`).
+	r_time_arr = StageAttribute()
+	d_time_arr = StageAttribute()
+	submission_time_arr = StageAttribute()
+	receive_at_ob_arr = StageAttribute()
+	ordering_arr = StageAttribute()
+	ack_time_arr = StageAttribute()
+	execution_time_arr = StageAttribute()
+	latency_arr = StageAttribute()
+
 	def __init__(self):
+		## Set to False to only keep latency statistics and not the latencies of individual trades.
+		self.keep_latency_arr = True
+		## One of `BACKENDS`.
+		self.backend = "numpy"
+		## Set to True to record the wall time and memory of each stage and metric (see `get_profile_report`).
+		self.profile = False
+		## Set to a number of worker processes to simulate the stages of the MPs which do not depend on
+		## other MPs in parallel in `run_simulation` (see `run_participant_stages`).
+		self.max_workers = None
+		## One of `RETENTION_POLICIES`.
+		self.retention = "all"
+		## Type of the stage arrays of the numpy backend, e.g., numpy.float32 to halve their memory. The
+		## orderings and `EXECUTION_INPUTS` stay in float64, so only arrays which are not read back are narrowed.
+		self.result_dtype = np.float64
 		self.reset_variables()
 
 	def reset_variables(self):
 		"""
 		Re-initiallize all class variables and reset environment.
 		"""
-		self.r_time_arr = []
-		self.d_time_arr = []
-		self.submission_time_arr = []
-		self.receive_at_ob_arr = []
-		self.ordering_arr = []
-		self.execution_time_arr = []
-		self.latency_arr = []
-		self.ack_time_arr = []
+		self.results = SimulationResults(self.result_dtype, self.EXECUTION_INPUTS)
+		self.ack_frontier = []
 		self.g_time = []
 		self.time_range = []
 		self.number_participants = []
@@ -49,6 +101,12 @@ class Algorithm():
 		self.fw_owd_arr = []
 		self.rv_owd_arr = []
 		self.response_times = []
+		self.environment = None
+		## Set by `run_streaming_simulation` if the chunks take their receive times from the environment.
+		self.stream_shared_r_time = False
+		self.ordered_pair_counts = None
+		self.latency_stats = LatencyStats(self.LATENCY_RESOLUTION)
+		self.profiler = StageProfiler()
 
 	def get_title(self):
 		"""
@@ -59,16 +117,44 @@ class Algorithm():
 		"""
 		raise NotImplementedError
 
+	def get_delay(self, ow_delay, times):
+		"""
+		Look up one way delays at the given times. Dense traces hold one delay per time step and are
+		indexed by the (truncated) time. Delays sampled at arbitrary times (`InterpolatedDelay`) are
+		interpolated, which allows simulating sparse data generation without dense traces.
+
+		Args:
+			ow_delay (numpy.ndarray or InterpolatedDelay): One way delays on the horizon, `time_range`.
+			times (numpy.ndarray): Real times to look up the delays at.
+
+		Returns:
+			numpy.ndarray: One way delays at `times`.
+		"""
+		if isinstance(ow_delay, InterpolatedDelay):
+			return ow_delay.lookup(times)
+		return np.asarray(ow_delay)[times.astype(int)]
+
 	def get_r_time(self, g_time, fwd_ow_delay):
 		"""
 		Calculates the time when the RB receives the data from the CES.
 
 		Args:
-			g_time (list(float)): Real times when CES generates data points.
-			fwd_ow_delay (list(float)): One way delay from CES to RB at all times of horizon, `time_range`.
+			g_time (numpy.ndarray): Real times when CES generates data points.
+			fwd_ow_delay (numpy.ndarray or InterpolatedDelay): One way delay from CES to RB at all times of horizon, `time_range`.
 
 		Returns:
-			list(float): Real times when RB receive various data points from the CES.
+			numpy.ndarray: Real times when RB receive various data points from the CES.
+		"""
+		if self.backend == "reference":
+			return self.get_r_time_reference(g_time, fwd_ow_delay)
+		g_time = np.asarray(g_time)
+		answer = g_time + self.get_delay(fwd_ow_delay, g_time)
+		assert(np.all(answer[:-1] <= answer[1:]))
+		return answer
+
+	def get_r_time_reference(self, g_time, fwd_ow_delay):
+		"""
+		Reference implementation of `get_r_time` for dense one way delay traces.
 		"""
 		answer = []
 		for i in range(len(g_time)):
@@ -97,11 +183,19 @@ class Algorithm():
   		generated after exactly `response_time` has passed since the data point is received by the MP.
 
 		Args:
-			d_time (list(float)): Real times when CES generates data points.
+			d_time (numpy.ndarray): Real times when CES generates data points.
 			response_time (float): Time taken by MP to respond to the data point with a trade.
 
 		Returns:
-			list(float): Real times when trade is submitted to the RB from the MP.
+			numpy.ndarray: Real times when trade is submitted to the RB from the MP.
+		"""
+		if self.backend == "reference":
+			return self.get_submission_time_reference(d_time, response_time)
+		return np.asarray(d_time) + response_time
+
+	def get_submission_time_reference(self, d_time, response_time):
+		"""
+		Reference implementation of `get_submission_time`.
 		"""
 		answer = []
 		for i in range(len(d_time)):
@@ -113,11 +207,20 @@ class Algorithm():
 		Calculate the time when trades generated by an MP reach the CES.
 
 		Args:
-			submission_time (list(float)): Real times when trade is submitted to the RB from the MP.
-			rv_owd (list(float)): One way delay from RB to CES at all times on the horizon, `time_range`.
+			submission_time (numpy.ndarray): Real times when trade is submitted to the RB from the MP.
+			rv_owd (numpy.ndarray or InterpolatedDelay): One way delay from RB to CES at all times on the horizon, `time_range`.
 
 		Returns:
-			list(float): Real times when trades are received by the OB.
+			numpy.ndarray: Real times when trades are received by the OB.
+		"""
+		if self.backend == "reference":
+			return self.get_receive_at_ob_reference(submission_time, rv_owd)
+		submission_time = np.asarray(submission_time)
+		return submission_time + self.get_delay(rv_owd, submission_time)
+
+	def get_receive_at_ob_reference(self, submission_time, rv_owd):
+		"""
+		Reference implementation of `get_receive_at_ob` for dense one way delay traces.
 		"""
 		answer = []
 		for i in range(len(submission_time)):
@@ -168,12 +271,20 @@ class Algorithm():
 		response to the data point minus the response time at the MP.
 
 		Args:
-			g_time (list(float)): Real times when CES generates data points.
-			execution_time (list(float)): Real times of execution of trades from a single MP at the CES.
+			g_time (numpy.ndarray): Real times when CES generates data points.
+			execution_time (numpy.ndarray): Real times of execution of trades from a single MP at the CES.
 			response_time (float): Time taken by MP to respond to the data point with a trade.
 
 		Returns:
-			list(float): The end-to-end latency for all trades from a single MP.
+			numpy.ndarray: The end-to-end latency for all trades from a single MP.
+		"""
+		if self.backend == "reference":
+			return self.get_e2e_latency_reference(g_time, execution_time, response_time)
+		return np.asarray(execution_time) - np.asarray(g_time) - response_time
+
+	def get_e2e_latency_reference(self, g_time, execution_time, response_time):
+		"""
+		Reference implementation of `get_e2e_latency`.
 		"""
 		answer = []
 		for i in range(len(g_time)):
@@ -181,23 +292,42 @@ class Algorithm():
 			answer.append(latency)
 		return answer
 
-	def set_simulation_environment(self, g_time, time_range, number_participants, fw_owd_arr, rv_owd_arr, response_times, g_step=1):
+	def set_simulation_environment(self, g_time, time_range=None, number_participants=None, fw_owd_arr=None, rv_owd_arr=None, response_times=None, g_step=1):
 		"""
 		Set the simulation environment. This function resets the environment variables before the simulation
 		and sets the rest of the variables to appropriate values.
 
 		Args:
-			g_time (list(float)): Real times when CES generates data points.
+			g_time (list(float) or SimulationEnvironment): Real times when CES generates data points. These need
+				not be evenly spaced (e.g., Poisson arrivals) if the one way delays are `InterpolatedDelay`s. A
+				`range` is kept as is, so that `run_streaming_simulation` does not hold all generation times in
+				memory. Alternatively, a `SimulationEnvironment` holding all the arguments; the results of stages
+				shared with other algorithms in the same environment (e.g., `r_time`) are then reused.
 			time_range (int): The time horizon being simulated.
 			number_participants (int): Number of MPs.
-			fw_owd_arr (list(float)): One way delay from CES to RB at all times of horizon, `time_range`.
-			rv_owd_arr (list(float)): One way delay from RB to CES at all times on the horizon, `time_range`.
+			fw_owd_arr (list(numpy.ndarray)): One way delay from CES to RB at all times of horizon, `time_range`,
+				for each RB. These may be views of a shared trace (see `util.OWDTrace`).
+			rv_owd_arr (list(numpy.ndarray)): One way delay from RB to CES at all times on the horizon, `time_range`,
+				for each RB. These may share their buffers with `fw_owd_arr`.
 			response_times (list(float)): Response times of the various MPs. `len(response_times)=number_participants`
-			g_step (int, optional): The frequency at which data is generated at the CES. Defaults to 1.
-		"""
+			g_step (int, optional): The frequency at which data is generated at the CES. For uneven generation
+				times, use the mean time between data points. Defaults to 1.
+		"""
+		if self.backend not in self.BACKENDS:
+			raise ValueError("Unknown backend %s, expected one of %s" % (self.backend, ", ".join(self.BACKENDS)))
+		if self.retention not in self.RETENTION_POLICIES:
+			raise ValueError("Unknown retention policy %s, expected one of %s" % (self.retention, ", ".join(self.RETENTION_POLICIES)))
+		if self.backend == "reference" and self.retention != "all":
+			raise ValueError("The reference backend calculates the metrics from all stages, so the retention policy should be all")
 		## reinitialize all state variables
 		self.reset_variables()
-		self.g_time = g_time
+		if isinstance(g_time, SimulationEnvironment):
+			self.environment = g_time
+			g_time, time_range, number_participants, fw_owd_arr, rv_owd_arr, response_times, g_step = (
+				self.environment.g_time, self.environment.time_range, self.environment.number_participants,
+				self.environment.fw_owd_arr, self.environment.rv_owd_arr, self.environment.response_times, self.environment.g_step)
+		## Stages operate on whole arrays, so convert the generation times once here.
+		self.g_time = g_time if isinstance(g_time, range) else np.asarray(g_time)
 		self.time_range = time_range
 		self.number_participants = number_participants
 		self.g_step = g_step
@@ -211,6 +341,385 @@ class Algorithm():
 		"""
 		raise NotImplementedError
 
+	def simulate_participant(self, i):
+		"""
+		Run the stages of MP`i` which do not depend on other MPs, e.g., up to the ordering of its trades.
+		Define this for each algorithm to support `run_participant_stages`.
+
+		Args:
+			i (int): Index of the MP.
+
+		Returns:
+			tuple(numpy.ndarray): Results of the stages for all data points, in the order of `PARTICIPANT_ARRAYS`.
+		"""
+		raise NotImplementedError
+
+	def run_participant_stages(self):
+		"""
+		Run `simulate_participant` for all MPs and add its results to the stage arrays in
+		`PARTICIPANT_ARRAYS` which are kept (see `keep_stage`). All MPs are simulated when this returns, so that the stages which
+		depend on all MPs (e.g., the execution of trades in DBO) can follow.
+
+		If `max_workers` is set, the MPs are simulated in a pool of worker processes which write the
+		results into preallocated shared (N, T) arrays, one for each stage kept, which then become the
+		stage arrays. This needs the numpy backend and the "fork" start method, as the workers use
+		the environment and shared memory of this process; otherwise the MPs are simulated in turn. Results
+		of stages shared through a `SimulationEnvironment` are reused by the workers but not added to it.
+		"""
+		if (self.max_workers is None or self.max_workers <= 1 or self.number_participants <= 1 or self.backend != "numpy"
+				or "fork" not in multiprocessing.get_all_start_methods()):
+			for i in range(self.number_participants):
+				for name, answer in zip(self.PARTICIPANT_ARRAYS, self.simulate_participant(i)):
+					self.add_stage_result(name, i, answer)
+			return
+
+		## Anonymous shared memory is inherited by the forked workers, and freed once no stage array uses it.
+		shared = {}
+		for name in self.PARTICIPANT_ARRAYS:
+			if self.keep_stage(name):
+				dtype = np.dtype(self.results.get_dtype(name))
+				size = self.number_participants*len(self.g_time)
+				buffer = mmap.mmap(-1, max(size, 1)*dtype.itemsize)
+				shared[name] = np.frombuffer(buffer, dtype=dtype, count=size).reshape(self.number_participants, len(self.g_time))
+		with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("fork"),
+				initializer=init_participant_worker, initargs=(self, shared)) as executor:
+			for records in executor.map(run_participant_worker, range(self.number_participants)):
+				self.profiler.records += records
+		for name in shared:
+			setattr(self, name, shared[name])
+
+	def keep_stage(self, name):
+		"""
+		Check if a stage array is kept after the MPs are simulated, i.e., if it is used by the stages
+		which depend on all MPs or by the metrics, or if the retention policy keeps all stages.
+
+		Args:
+			name (str): Name of the stage array, e.g., "r_time_arr".
+
+		Returns:
+			bool: True if the stage array is kept.
+		"""
+		## The fairness counts are calculated from the orderings once the simulation is complete.
+		return self.retention == "all" or name in self.EXECUTION_INPUTS or name == "ordering_arr"
+
+	def add_stage_result(self, name, i, answer):
+		"""
+		Add the result of a stage for MP`i` to its stage array, if the stage array is kept (see `keep_stage`).
+
+		Args:
+			name (str): Name of the stage array, e.g., "r_time_arr".
+			i (int): Index of the MP.
+			answer (numpy.ndarray): Result of the stage for MP`i`.
+		"""
+		if not self.keep_stage(name):
+			return
+		if self.backend == "reference":
+			getattr(self, name).append(answer)
+		else:
+			self.results.set_row(name, i, self.number_participants, answer)
+
+	def release_stages(self, *names):
+		"""
+		Release stage arrays which are no longer needed by later stages, unless the retention policy
+		keeps them. Without arguments, the simulation is complete and all stage arrays not kept by the
+		retention policy are released; for "none", the fairness counts are calculated first.
+
+		Args:
+			*names (str): Names of the stage arrays, e.g., "ack_time_arr".
+		"""
+		if self.retention == "all":
+			return
+		if len(names) == 0:
+			if self.retention == "none":
+				self.count_correctly_ordered_pairs(0)
+			names = [name for name in SimulationResults.STAGES if name != "ordering_arr" or self.retention == "none"]
+		self.results.release(*names)
+
+	def get_chunk_end(self, index):
+		"""
+		Get the end of a chunk of data points simulated by `run_streaming_simulation`. Algorithms
+		with state across data points (e.g., batches) can move the end such that the state is
+		carried over between chunks.
+
+		Args:
+			index (int): Index of the data point at which the chunk should end.
+
+		Returns:
+			int: Index of the data point at which the chunk ends, at least `index`.
+		"""
+		return min(index, len(self.g_time))
+
+	def simulate_chunk(self, st, en, la):
+		"""
+		Simulate the trades in response to the data points `st` to `en` (excluded) using the data
+		points up to `la` (excluded). Define this for each algorithm to support `run_streaming_simulation`.
+		State carried to the next chunk should only be updated if the trades are complete.
+
+		Args:
+			st (int): Index of the first data point of the chunk.
+			en (int): Index of the data point after the chunk, returned by `get_chunk_end`.
+			la (int): Index of the data point after the lookahead, returned by `get_chunk_end`.
+
+		Returns:
+			tuple(list(numpy.ndarray)): Ordering and execution times of the trades from each MP, or None if
+				the trades depend on data points after `la` (and `la` is not the last data point).
+		"""
+		raise NotImplementedError
+
+	def start_streaming_simulation(self):
+		"""
+		Initialize the state carried across chunks by `simulate_chunk`.
+		"""
+		pass
+
+	def run_streaming_simulation(self, chunk_size=None):
+		"""
+		Run the simulation in chunks of data points, so that memory does not grow with the horizon.
+		Each chunk is simulated along with enough later data points (see `STREAM_LOOKAHEAD`) to complete
+		its trades, and the fairness counts and latency statistics are updated for the chunk. The stage
+		arrays (`r_time_arr`, ..., `latency_arr`) are not kept, so only the metrics are available after
+		the simulation. The metrics are the same as with `run_simulation`.
+
+		Use a `range` or `InterpolatedDelay`s in `set_simulation_environment` so that the generation times
+		and one way delays do not need memory proportional to the horizon either. If the environment is a
+		`SimulationEnvironment`, the receive times of all MPs over the whole horizon are taken from it
+		(see `get_chunk_r_time`), which takes memory proportional to the horizon but is shared with the
+		other algorithms in the environment; a warning is given if they do not fit in its cache.
+
+		Args:
+			chunk_size (int, optional): Number of data points in a chunk. Defaults to `STREAM_CHUNK_TRADES`
+				trades over all MPs.
+		"""
+		## The environment should be set before calling this function.
+		if self.backend != "numpy":
+			raise ValueError("Streaming simulation is only implemented for the numpy backend")
+		chunk_size = chunk_size or max(1, self.STREAM_CHUNK_TRADES//self.number_participants)
+		self.ordered_pair_counts = np.zeros(self.number_participants, dtype=np.int64)
+		## Receive times evicted while the chunks are simulated would be calculated again for each chunk.
+		self.stream_shared_r_time = self.environment is not None and self.number_participants*len(self.g_time)*np.dtype(np.float64).itemsize <= self.environment.max_cache_bytes
+		if self.environment is not None and not self.stream_shared_r_time:
+			warnings.warn("The receive times of %d MPs over %d data points do not fit in the cache of the simulation environment; "
+				"they are calculated for each chunk instead" % (self.number_participants, len(self.g_time)))
+		self.start_streaming_simulation()
+
+		st = 0
+		while st < len(self.g_time):
+			en = self.get_chunk_end(st + chunk_size)
+			lookahead = self.STREAM_LOOKAHEAD
+			while True:
+				la = self.get_chunk_end(en + lookahead)
+				chunk = self.simulate_chunk(st, en, la)
+				if chunk is not None:
+					break
+				lookahead *= 2
+			self.record_chunk(st, en, *chunk)
+			st = en
+
+	def get_chunk_r_time(self, i, st, en, g_time):
+		"""
+		Get the times when RB`i` receives the data points `st` to `en` (excluded), for `simulate_chunk`.
+		If the environment is a `SimulationEnvironment` (see `run_streaming_simulation`), they are sliced
+		from the receive times over the whole horizon, which are calculated once for all algorithms in
+		the environment (see `run_shared_stage`).
+
+		Args:
+			i (int): Index of the MP.
+			st (int): Index of the first data point.
+			en (int): Index of the data point after the last one.
+			g_time (numpy.ndarray): Real times when CES generates the data points `st` to `en` (excluded).
+
+		Returns:
+			numpy.ndarray: Real times when RB`i` receives the data points.
+		"""
+		if self.stream_shared_r_time:
+			return self.run_shared_stage("r_time", i, self.get_r_time, self.g_time, self.fw_owd_arr[i])[st:en]
+		return self.run_stage("r_time", i, self.get_r_time, g_time, self.fw_owd_arr[i])
+
+	def record_chunk(self, st, en, ordering_arr, execution_time_arr):
+		"""
+		Update the fairness counts and latency statistics with the trades in response to the data
+		points `st` to `en` (excluded), simulated by `simulate_chunk`.
+
+		Args:
+			st (int): Index of the first data point of the chunk.
+			en (int): Index of the data point after the chunk.
+			ordering_arr (list(numpy.ndarray)): Ordering of the trades from each MP.
+			execution_time_arr (list(numpy.ndarray)): Real times of execution of the trades from each MP.
+		"""
+		self.ordered_pair_counts += self.run_stage("fairness", None, self.count_ordered_pairs, ordering_arr)
+		## Ignore the latencies of the last 25/g_step points to ensure they are within `time_range`.
+		latency_end = len(self.g_time) - int((25.0/self.g_step) + 1)
+		g_time = np.asarray(self.g_time[st:en])
+		for i in range(self.number_participants):
+			latency = self.run_stage("latency", i, self.get_e2e_latency, g_time, execution_time_arr[i], self.response_times[i])
+			self.latency_stats.add(latency[:max(0, latency_end - st)])
+
+	def run_stage(self, stage, participant, function, *args):
+		"""
+		Run a stage of the simulation, i.e., call `function(*args)`. If `profile` is set, the wall
+		time and memory allocated are recorded by the profiler.
+
+		Args:
+			stage (str): Name of the stage, e.g., "r_time" or "execution".
+			participant (int): Index of the MP the stage is run for, or None for stages over all MPs.
+			function (function): Function running the stage.
+
+		Returns:
+			Value returned by `function`.
+		"""
+		if not self.profile:
+			return function(*args)
+		return self.profiler.measure(stage, participant, function, *args)
+
+	def get_stage_key(self, stage):
+		"""
+		Get the inputs of a stage which are not part of the simulation environment, to identify its
+		results in a `SimulationEnvironment` shared by several algorithms. Stages of algorithms with the
+		same key have the same results.
+
+		Args:
+			stage (str): Name of the stage, e.g., "r_time".
+
+		Returns:
+			tuple: Inputs of the stage, or None if its results should not be shared.
+		"""
+		if stage == "r_time":
+			## The receive times only depend on the environment.
+			return ()
+		return None
+
+	def run_shared_stage(self, stage, participant, function, *args):
+		"""
+		Run a stage of the simulation for the whole horizon (see `run_stage`). If the environment is a
+		`SimulationEnvironment`, stages with a key (see `get_stage_key`) are run once for all algorithms
+		in the environment and their results are reused.
+
+		Args:
+			stage (str): Name of the stage, e.g., "r_time".
+			participant (int): Index of the MP the stage is run for.
+			function (function): Function running the stage.
+
+		Returns:
+			Value returned by `function`, or the result from the environment.
+		"""
+		key = self.get_stage_key(stage) if self.environment is not None and self.backend == "numpy" else None
+		if key is None:
+			return self.run_stage(stage, participant, function, *args)
+		return self.environment.get_stage((stage, participant) + key, self.run_stage, stage, participant, function, *args)
+
+	def record_participant_latency(self, i, execution_time):
+		"""
+		Calculate and record the latency for each trade from MP`i` (ignore last 25/g_step points to
+		ensure it is within `time_range`).
+
+		Args:
+			i (int): Index of the MP.
+			execution_time (numpy.ndarray): Real times of execution of trades from MP`i` at the CES.
+		"""
+		self.record_latency(i, self.get_e2e_latency(
+			self.g_time, execution_time, self.response_times[i])[:(-int((25.0/self.g_step) + 1))])
+
+	def get_profile_report(self):
+		"""
+		Get the wall time and memory of the stages and metrics recorded since the environment was
+		set. Only recorded if `profile` is set. The individual records are in `profiler.records`.
+
+		Returns:
+			dict: Summary of each stage and metric (see `profiler.StageProfiler.get_report`).
+		"""
+		return self.profiler.get_report()
+
+	def count_ordered_pairs(self, ordering_arr, group_size=None):
+		"""
+		Count the competing trade pairs that are ordered correctly, i.e., the trade from the MP
+		with smaller response time is ordered ahead, for each MP as the faster MP of the pair. MPs
+		are ranked by response time (ties broken by index).
+
+		For each data point the MPs are ranked by the ordering of their trades and the correctly ordered
+		pairs are counted from these ranks using a Fenwick tree, vectorized over data points. This takes
+		O(N.T.log N) instead of comparing all N^2 pairs of MPs.
+
+		Args:
+			ordering_arr (list(numpy.ndarray)): Ordering of trades from each MP, for the same data points.
+			group_size (int, optional): If given, the data points are consecutive groups of `group_size`
+				(e.g., the same data points for several parameters) and the pairs are counted for each group.
+				Defaults to None.
+
+		Returns:
+			numpy.ndarray: Number of correctly ordered pairs over all data points in which the `a`th fastest
+				MP is the faster MP, for each `a`, with a leading axis of groups if `group_size` is given.
+		"""
+		n = self.number_participants
+		fast_order = sorted(range(n), key=lambda i: (self.response_times[i], i))
+		length = len(ordering_arr[0])
+		groups = 1 if group_size is None else -(-length//group_size)
+		answer = np.zeros((groups, n), dtype=np.int64)
+		for st in range(0, length, self.FAIRNESS_CHUNK_SIZE):
+			# Row `a` holds the ordering of trades from the `a`th fastest MP.
+			ordering = np.stack([np.asarray(ordering_arr[i][st:st+self.FAIRNESS_CHUNK_SIZE]) for i in fast_order])
+			cols = np.arange(ordering.shape[1])
+			# Rank MPs by ordering for each data point. Equal orderings are ranked slower MP first, as
+			# such pairs are not ordered correctly.
+			sorted_rows = n - 1 - np.argsort(ordering[::-1], axis=0, kind='stable')
+			rank = np.empty_like(sorted_rows)
+			np.put_along_axis(rank, sorted_rows, np.arange(n)[:, None], axis=0)
+
+			# A pair (a, b) with a < b is ordered correctly if rank[a] < rank[b]. Slower MPs are added to
+			# the tree first, so that the tree holds the ranks of all MPs `b` > `a` when `a` is counted.
+			# The Fenwick tree for data point `k` is stored at `tree[k::width]`. Row n+1 absorbs updates
+			# beyond the last node so that all data points can be stepped together.
+			width = ordering.shape[1]
+			# Data points of the block from `starts[g]` (included) to `starts[g+1]` (excluded) are in group `group[g]`.
+			group = np.zeros(1, dtype=np.int64) if group_size is None else np.arange(st//group_size, (st + width - 1)//group_size + 1)
+			starts = np.maximum(group*(group_size or 0) - st, 0)
+			sizes = np.diff(np.append(starts, width))
+			tree = np.zeros((n + 2)*width, dtype=np.int64)
+			for a in range(n - 1, -1, -1):
+				# Count the slower MPs ranked ahead of MP `a`; the rest are ordered correctly.
+				ind = rank[a].copy()
+				ahead = np.zeros(width, dtype=np.int64)
+				for _ in range(n.bit_length()):
+					ahead += tree[ind*width + cols]
+					ind -= ind & -ind
+				answer[group, a] += (n - 1 - a)*sizes - np.add.reduceat(ahead, starts)
+				ind = rank[a] + 1
+				for _ in range(n.bit_length()):
+					tree[np.minimum(ind, n + 1)*width + cols] += 1
+					ind += ind & -ind
+		return answer[0] if group_size is None else answer
+
+	def count_correctly_ordered_pairs(self, number_fast):
+		"""
+		Count the competing trade pairs that are ordered correctly, where pairs are counted only if
+		the faster MP is among the first `number_fast` MPs in increasing order of response times.
+		The counts for each MP (see `count_ordered_pairs`) are calculated once and kept on the object.
+
+		Args:
+			number_fast (int): Number of MPs (in increasing order of response times) whose trades should be ahead.
+
+		Returns:
+			int: Number of correctly ordered trade pairs over all data points.
+		"""
+		if self.ordered_pair_counts is None:
+			self.ordered_pair_counts = self.count_ordered_pairs(self.ordering_arr)
+		return int(self.ordered_pair_counts[:number_fast].sum())
+
+	def get_fairness_ratio(self, number_fast):
+		"""
+		Calculate the fraction of competing trade pairs ordered correctly, where pairs are counted
+		only if the faster MP is among the first `number_fast` MPs in increasing order of response times.
+
+		Args:
+			number_fast (int): Number of MPs (in increasing order of response times) whose trades should be ahead.
+
+		Returns:
+			float: Win fraction (fairness) between the selected participants for all trades.
+		"""
+		n = self.number_participants
+		total = number_fast*(n-1) - number_fast*(number_fast-1)//2
+		return self.count_correctly_ordered_pairs(number_fast)/(1.0*total*len(self.g_time))
+
+	@profiled_metric
 	def get_win_fraction(self):
 		"""
 		Calculate the fairness ratio as ratio of the number of competing trade pairs that were
@@ -220,6 +729,14 @@ class Algorithm():
 		Returns:
 			float: Win fraction (fairness) between all participants for all trades.
 		"""
+		if self.backend == "reference":
+			return self.get_win_fraction_reference()
+		return self.get_fairness_ratio(self.number_participants)
+
+	def get_win_fraction_reference(self):
+		"""
+		Reference implementation of `get_win_fraction`, comparing all pairs of MPs.
+		"""
 		win_fraction = 0
 		total = 0
 		for i in range(self.number_participants):
@@ -233,6 +750,7 @@ class Algorithm():
 					win_fraction += self.win_prob_2_before_1(self.ordering_arr[j], self.ordering_arr[i])
 		return win_fraction/total
 
+	@profiled_metric
 	def get_lrtf_fariness_ratio(self, delta):
 		"""
 		Calculate the fairness ratio as ratio of the number of competing trade pairs that were
@@ -245,6 +763,15 @@ class Algorithm():
 		Returns:
 			float: Win fraction (fairness) between all participants for all trades.
 		"""
+		if self.backend == "reference":
+			return self.get_lrtf_fariness_ratio_reference(delta)
+		## For LRTF, the smaller response time should be less than delta to ensure LRTF fairness.
+		return self.get_fairness_ratio(sum(1 for rt in self.response_times if rt < delta))
+
+	def get_lrtf_fariness_ratio_reference(self, delta):
+		"""
+		Reference implementation of `get_lrtf_fariness_ratio`, comparing all pairs of MPs.
+		"""
 		win_fraction = 0
 		total = 0
 		for i in range(self.number_participants):
@@ -261,21 +788,74 @@ class Algorithm():
 					win_fraction += self.win_prob_2_before_1(self.ordering_arr[j], self.ordering_arr[i])
 		return win_fraction/total
 
+	def record_latency(self, i, latency):
+		"""
+		Record the end-to-end latencies of trades from MP`i` in the latency statistics. The latencies
+		are also kept in `latency_arr` if `keep_latency_arr` is set and the retention policy keeps all stages.
 
+		Args:
+			i (int): Index of the MP.
+			latency (numpy.ndarray): The end-to-end latency for all trades from a single MP.
+		"""
+		self.latency_stats.add(latency)
+		if self.keep_latency_arr:
+			self.add_stage_result("latency_arr", i, latency)
+
+	@profiled_metric
 	def get_mean_latency(self):
 		"""
 		Get mean end-to-end latency of the trades.
 		"""
-		return np.mean(np.array(self.latency_arr))
+		if self.backend == "reference":
+			return np.mean(np.array(self.latency_arr))
+		return self.latency_stats.get_mean()
+
+	@profiled_metric
+	def get_latency_percentile(self, q):
+		"""
+		Get the `q`th percentile end-to-end latency of the trades. This is estimated from the
+		latency statistics and is accurate to within `LATENCY_RESOLUTION` up to `LatencyStats.LINEAR_LIMIT`,
+		and to within a relative error of `LATENCY_RESOLUTION/LatencyStats.LINEAR_LIMIT` beyond it. The
+		reference backend calculates it exactly from `latency_arr`.
+
+		Args:
+			q (float): Percentile to calculate, between 0 and 100.
+		"""
+		if self.backend == "reference":
+			return np.percentile(np.array(self.latency_arr).flatten(), q)
+		return self.latency_stats.get_percentile(q)
 
 	def get_99p_latency(self):
 		"""
 		Get 99 percentile end-to-end latency of the trades.
 		"""
-		return np.percentile(np.array(self.latency_arr).flatten(), 99)
+		return self.get_latency_percentile(99)
 
+	@profiled_metric
 	def get_max_latency(self):
 		"""
 		Get maximum end-to-end latency of the trades.
 		"""
-		return np.max(np.array(self.latency_arr))
+		if self.backend == "reference":
+			return np.max(np.array(self.latency_arr))
+		return self.latency_stats.get_max()
+
+
+## Algorithm and shared stage arrays used by a worker process of `Algorithm.run_participant_stages`.
+participant_worker_state = {}
+
+
+def init_participant_worker(sim_obj, shared):
+	participant_worker_state["algorithm"] = sim_obj
+	participant_worker_state["shared"] = shared
+
+
+def run_participant_worker(i):
+	sim_obj = participant_worker_state["algorithm"]
+	## Only return the profiler records of this MP.
+	sim_obj.profiler.records = []
+	shared = participant_worker_state["shared"]
+	for name, answer in zip(sim_obj.PARTICIPANT_ARRAYS, sim_obj.simulate_participant(i)):
+		if name in shared:
+			shared[name][i] = answer
+	return sim_obj.profiler.records
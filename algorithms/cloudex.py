@@ -1,10 +1,15 @@
+import numpy as np
 from .algorithm import Algorithm
+from .latency_stats import LatencyStats
 
 class Cloudex(Algorithm):
 	"""
 	Cloudex algorithm which assumes perfect clock synchronization and buffers data points and trades
 	at RBs and OB.
 	"""
+	PARTICIPANT_ARRAYS = ("r_time_arr", "d_time_arr", "submission_time_arr", "receive_at_ob_arr", "ordering_arr", "execution_time_arr")
+	EXECUTION_INPUTS = ("execution_time_arr",)
+
 	def __init__(self, d_o, d_i):
 		# Cloudex threshold delay at the RB. This is the minimum time since generation after which
 		# a data point may be delivered to an MP.
@@ -29,11 +34,19 @@ class Cloudex(Algorithm):
 		Overriding the method from the super class (Algorithm).
 
 		Args:
-			g_time (list(float)): Real times when CES generates data points.
-			r_time (list(float)): Real times when RB receive various data points from the CES.
+			g_time (numpy.ndarray): Real times when CES generates data points.
+			r_time (numpy.ndarray): Real times when RB receive various data points from the CES.
 
 		Returns:
-			list(float): Real times when RB sends data points to the MP.
+			numpy.ndarray: Real times when RB sends data points to the MP.
+		"""
+		if self.backend == "reference":
+			return self.get_d_time_reference(g_time, r_time)
+		return np.maximum(np.asarray(g_time) + self.d_o, r_time)
+
+	def get_d_time_reference(self, g_time, r_time):
+		"""
+		Reference implementation of `get_d_time`.
 		"""
 		answer = []
 		for i in range(len(r_time)):
@@ -54,11 +67,19 @@ class Cloudex(Algorithm):
 		Overriding the method from the super class (Algorithm).
 
 		Args:
-			submission_time (list(float)): Real times when trade is submitted to the RB from the MP.
-			receive_at_ob (list(float)): Real times when trades are received by the OB.
+			submission_time (numpy.ndarray): Real times when trade is submitted to the RB from the MP.
+			receive_at_ob (numpy.ndarray): Real times when trades are received by the OB.
 
 		Returns:
-			list(float): A total ordering of trades.
+			numpy.ndarray: A total ordering of trades.
+		"""
+		if self.backend == "reference":
+			return self.get_ordering_reference(submission_time, receive_at_ob)
+		return np.maximum(np.asarray(submission_time) + self.d_i, receive_at_ob)
+
+	def get_ordering_reference(self, submission_time, receive_at_ob):
+		"""
+		Reference implementation of `get_ordering`.
 		"""
 		answer = []
 		for i in range(len(submission_time)):
@@ -82,23 +103,129 @@ class Cloudex(Algorithm):
 		"""
 		return ordering
 
+	def simulate_chunk(self, st, en, la):
+		"""
+		Simulate the trades in response to the data points `st` to `en` (excluded). The trades of
+		Cloudex only depend on their own data point, so no lookahead is used.
+
+		Overriding the method from the super class (Algorithm).
+		"""
+		g_time = np.asarray(self.g_time[st:en])
+		ordering_arr = []
+		execution_time_arr = []
+		for i in range(self.number_participants):
+			r_time = self.get_chunk_r_time(i, st, en, g_time)
+			d_time = self.run_stage("d_time", i, self.get_d_time, g_time, r_time)
+			submission_time = self.run_stage("submission", i, self.get_submission_time, d_time, self.response_times[i])
+			receive_at_ob = self.run_stage("receive_at_ob", i, self.get_receive_at_ob, submission_time, self.rv_owd_arr[i])
+			ordering_arr.append(self.run_stage("ordering", i, self.get_ordering, submission_time, receive_at_ob))
+			execution_time_arr.append(self.run_stage("execution", i, self.get_execution_time, ordering_arr[i]))
+		return ordering_arr, execution_time_arr
+
+	def simulate_participant(self, i):
+		"""
+		Run the stages of MP`i` up to the execution of its trades, which do not depend on other MPs.
+
+		Overriding the method from the super class (Algorithm).
+		"""
+		# Calculate the times when the RB`i` receives the data points from the CES using the one way delays.
+		r_time = self.run_shared_stage("r_time", i, self.get_r_time, self.g_time, self.fw_owd_arr[i])
+		# Calculate when the data point is delivered by the RB`i` to the MP`i`.
+		d_time = self.run_stage("d_time", i, self.get_d_time, self.g_time, r_time)
+		# Calculate when trades are generated by MP`i` in response to the data points received and sent to the RB`i`.
+		submission_time = self.run_stage("submission", i, self.get_submission_time, d_time, self.response_times[i])
+		# Calculate when trades are received at the OB from RB`i`.
+		receive_at_ob = self.run_stage("receive_at_ob", i, self.get_receive_at_ob, submission_time, self.rv_owd_arr[i])
+		# Calculate the order of trades from RB`i` at the CES.
+		ordering = self.run_stage("ordering", i, self.get_ordering, submission_time, receive_at_ob)
+		# Calculate the execution time of trades from RB`i` at the CES
+		execution_time = self.run_stage("execution", i, self.get_execution_time, ordering)
+		return r_time, d_time, submission_time, receive_at_ob, ordering, execution_time
+
 	def run_simulation(self):
 		## The environment should be set before calling this function.
+		self.run_participant_stages()
 		for i in range(self.number_participants):
-			# Calculate the times when the RB`i` receives the data points from the CES using the one way delays.
-			self.r_time_arr.append(self.get_r_time(self.g_time, self.fw_owd_arr[i]))
-			# Calculate when the data point is delivered by the RB`i` to the MP`i`.
-			self.d_time_arr.append(self.get_d_time(self.g_time, self.r_time_arr[i]))
-			# Calculate when trades are generated by MP`i` in response to the data points received and sent to the RB`i`.
-			self.submission_time_arr.append(self.get_submission_time(self.d_time_arr[i], self.response_times[i]))
-			# Calculate when trades are received at the OB from RB`i`.
-			self.receive_at_ob_arr.append(self.get_receive_at_ob(self.submission_time_arr[i], self.rv_owd_arr[i]))
-			# Calculate the order of trades from RB`i` at the CES.
-			self.ordering_arr.append(self.get_ordering(self.submission_time_arr[i], self.receive_at_ob_arr[i]))
-			# Calculate the execution time of trades from RB`i` at the CES
-			self.execution_time_arr.append(self.get_execution_time(self.ordering_arr[i]))
-			# Calculate the latency for each trade (ignore last 25/g_step points to ensure it is within `time_range`)
-			self.latency_arr.append(self.get_e2e_latency(
-				self.g_time, self.execution_time_arr[i], self.response_times[i])[:(-int((25.0/self.g_step) + 1))])
+			# Calculate the latency for each trade.
+			self.run_stage("latency", i, self.record_participant_latency, i, self.execution_time_arr[i])
+		self.release_stages()
 
 
+class CloudexThresholds(Cloudex):
+	"""
+	Cloudex for several thresholds `(d_o, d_i)` at once, e.g., to plot latency against fairness.
+	The thresholds only enter the element-wise maxima in `get_d_time` and `get_ordering`, so `r_time`
+	is calculated once for each MP and the later stages broadcast over a leading axis of thresholds.
+
+	The simulation runs in chunks of data points (see `Algorithm.run_streaming_simulation`) and keeps
+	the fairness counts and latency statistics of each threshold. Use `get_threshold_algorithms` to
+	get the metrics of each threshold. The fairness counts of all thresholds are calculated together,
+	but they are still per threshold work and take most of the run time, so sweeps do not use this:
+	separate `Cloudex` runs spread over the workers sooner.
+	"""
+	def __init__(self, thresholds):
+		"""
+		Args:
+			thresholds (list(tuple(float, float))): Threshold delays `(d_o, d_i)` at the RB and the OB.
+		"""
+		self.thresholds = [tuple(threshold) for threshold in thresholds]
+		super().__init__(np.array([d_o for d_o, _ in self.thresholds])[:, None], np.array([d_i for _, d_i in self.thresholds])[:, None])
+
+	def get_title(self):
+		return "Cloudex({thresholds})".format(thresholds = ",".join("{d_o}|{d_i}".format(d_o = d_o, d_i = d_i) for d_o, d_i in self.thresholds))
+
+	def reset_variables(self):
+		super().reset_variables()
+		self.threshold_pair_counts = np.zeros((len(self.thresholds), 0), dtype=np.int64)
+		self.threshold_latency_stats = [LatencyStats(self.LATENCY_RESOLUTION) for _ in self.thresholds]
+
+	def start_streaming_simulation(self):
+		self.threshold_pair_counts = np.zeros((len(self.thresholds), self.number_participants), dtype=np.int64)
+
+	def record_chunk(self, st, en, ordering_arr, execution_time_arr):
+		"""
+		Update the fairness counts and latency statistics of each threshold with the trades in
+		response to the data points `st` to `en` (excluded). The orderings and execution times of each
+		MP have a leading axis of thresholds.
+
+		Overriding the method from the super class (Algorithm).
+		"""
+		## Count the pairs of all thresholds together, with the data points of each threshold as a group.
+		self.threshold_pair_counts += self.run_stage("fairness", None, self.count_ordered_pairs, [ordering.ravel() for ordering in ordering_arr], en - st)
+		## Ignore the latencies of the last 25/g_step points to ensure they are within `time_range`.
+		latency_end = len(self.g_time) - int((25.0/self.g_step) + 1)
+		g_time = np.asarray(self.g_time[st:en])
+		## Latencies of the trades with a leading axis of thresholds, then MPs.
+		latency = np.stack([self.run_stage("latency", i, self.get_e2e_latency, g_time, execution_time_arr[i], self.response_times[i])
+			for i in range(self.number_participants)], axis=1)
+		for p in range(len(self.thresholds)):
+			self.threshold_latency_stats[p].add(latency[p, :, :max(0, latency_end - st)])
+
+	def run_simulation(self, chunk_size=None):
+		"""
+		Run the simulation for all thresholds. Only the metrics of each threshold are kept.
+
+		Args:
+			chunk_size (int, optional): Number of data points simulated together. Defaults to `STREAM_CHUNK_TRADES`
+				trades over all MPs and thresholds, so that memory does not grow with the number of thresholds.
+		"""
+		## The environment should be set before calling this function.
+		self.run_streaming_simulation(chunk_size or max(1, self.STREAM_CHUNK_TRADES//(self.number_participants*len(self.thresholds))))
+
+	def get_threshold_algorithms(self):
+		"""
+		Get the results for each threshold as a `Cloudex` in the same environment, as if it was simulated
+		alone. Only the metrics (e.g., `get_win_fraction`, `get_99p_latency`) are available.
+
+		Returns:
+			list(Cloudex): Results for each threshold, in the order of `thresholds`.
+		"""
+		answer = []
+		for p, (d_o, d_i) in enumerate(self.thresholds):
+			sim_obj = Cloudex(d_o, d_i)
+			sim_obj.set_simulation_environment(self.g_time, self.time_range, self.number_participants,
+				self.fw_owd_arr, self.rv_owd_arr, self.response_times, self.g_step)
+			sim_obj.ordered_pair_counts = self.threshold_pair_counts[p]
+			sim_obj.latency_stats = self.threshold_latency_stats[p]
+			answer.append(sim_obj)
+		return answer
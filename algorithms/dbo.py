@@ -1,4 +1,8 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from .algorithm import Algorithm
+from .events import InterpolatedDelay
 
 class DBO(Algorithm):
 	"""
@@ -8,6 +12,9 @@ class DBO(Algorithm):
 	respond with a trade for each data point which is submitted to the RB. RBs timestamp and
 	forward trades to the OB which orders them and asks CES to execute them accordingly.
 	"""
+	PARTICIPANT_ARRAYS = ("r_time_arr", "d_time_arr", "submission_time_arr", "receive_at_ob_arr", "ordering_arr", "ack_time_arr")
+	EXECUTION_INPUTS = ("ordering_arr", "ack_time_arr")
+
 	def __init__(self, delta=0, batch_size=0, inter_batch_time=0):
 		self.delta = delta
 		self.batch_size = batch_size
@@ -17,7 +24,7 @@ class DBO(Algorithm):
 	def get_title(self):
 		return "DBO({delta}|{bs}|{ibt})".format(delta = self.delta, bs = self.batch_size, ibt = self.inter_batch_time)
 
-	def get_d_time(self, g_time, r_time):
+	def get_d_time(self, g_time, r_time, last_batch_delivery_time=-100):
 		"""
 		Calculate the times when data points, received from the CES at RB, are sent to the MP.
 		It assumes that the MP is very close to the RB and hence the transmission time is
@@ -33,11 +40,88 @@ class DBO(Algorithm):
 		Overriding the method from the super class (Algorithm).
 
 		Args:
-			g_time (list(float)): Real times when CES generates data points.
-			r_time (list(float)): Real times when RB receive various data points from the CES.
+			g_time (numpy.ndarray): Real times when CES generates data points.
+			r_time (numpy.ndarray): Real times when RB receive various data points from the CES.
+			last_batch_delivery_time (float, optional): Delivery time of the batch before `g_time[0]`, to continue
+				pacing from an earlier chunk of data points. Defaults to -100, i.e., no earlier batch.
 
 		Returns:
-			list(float): Real times when RB sends data points to the MP.
+			numpy.ndarray: Real times when RB sends data points to the MP.
+		"""
+		if self.backend == "reference":
+			return self.get_d_time_reference(g_time, r_time)
+		batch_starts, batch_counts = self.get_batches(g_time)
+		batch_complete_time = self.get_batch_complete_time(r_time, batch_starts)
+		batch_delivery_time = self.get_batch_delivery_time(batch_complete_time, last_batch_delivery_time)
+		answer = self.get_point_delivery_time(batch_starts, batch_counts, batch_delivery_time)
+		assert(len(g_time) == len(answer))
+		return answer
+
+	def get_batches(self, g_time):
+		"""
+		Batch the data points based on `batch_size`. A new batch starts whenever the batch number changes.
+
+		Args:
+			g_time (numpy.ndarray): Real times when CES generates data points.
+
+		Returns:
+			tuple(numpy.ndarray): Index of the first data point and number of data points of each batch.
+		"""
+		batch_number = (np.asarray(g_time)/self.batch_size).astype(int)
+		batch_starts = np.concatenate(([0], np.flatnonzero(np.diff(batch_number)) + 1))
+		batch_counts = np.diff(np.append(batch_starts, len(batch_number)))
+		return batch_starts, batch_counts
+
+	def get_batch_complete_time(self, r_time, batch_starts):
+		"""
+		Get the times when batches are complete, i.e., when their last data point is received at the RB.
+
+		Args:
+			r_time (numpy.ndarray): Real times when RB receive various data points from the CES.
+			batch_starts (numpy.ndarray): Index of the first data point of each batch.
+
+		Returns:
+			numpy.ndarray: Real times when the batches are complete at the RB.
+		"""
+		return np.maximum.reduceat(np.asarray(r_time), batch_starts)
+
+	def get_batch_delivery_time(self, batch_complete_time, last_batch_delivery_time=-100):
+		"""
+		Pace the batches. RB delivers the batch to MP when all data points in a batch are received
+		at the RB or the time since last batch was delivered is delta, whichever is later.
+
+		Args:
+			batch_complete_time (numpy.ndarray): Real times when the batches are complete at the RB.
+			last_batch_delivery_time (float, optional): Delivery time of the batch before the first batch. Defaults to -100.
+
+		Returns:
+			list(float): Real times when RB delivers the batches to the MP.
+		"""
+		batch_delivery_time = []
+		for complete_time in batch_complete_time.tolist():
+			last_batch_delivery_time = max(complete_time, last_batch_delivery_time + self.delta)
+			batch_delivery_time.append(last_batch_delivery_time)
+		return batch_delivery_time
+
+	def get_point_delivery_time(self, batch_starts, batch_counts, batch_delivery_time):
+		"""
+		Get the delivery times of the data points. Points within a batch are delivered `inter_batch_time`
+		apart, starting at the batch delivery time.
+
+		Args:
+			batch_starts (numpy.ndarray): Index of the first data point of each batch.
+			batch_counts (numpy.ndarray): Number of data points in each batch.
+			batch_delivery_time (list(float)): Real times when RB delivers the batches to the MP.
+
+		Returns:
+			numpy.ndarray: Real times when RB sends data points to the MP.
+		"""
+		position_in_batch = np.arange(int(batch_counts.sum())) - np.repeat(batch_starts, batch_counts)
+		return np.repeat(batch_delivery_time, batch_counts) + position_in_batch*self.inter_batch_time
+
+	def get_d_time_reference(self, g_time, r_time):
+		"""
+		Reference implementation of `get_d_time`, batching one data point at a time.
 		"""
 		answer = []
 
@@ -84,12 +168,41 @@ class DBO(Algorithm):
 		Overriding the method from the super class (Algorithm).
 
 		Args:
-			d_time (list(float)): Real times when RB sends data points to the MP.
-			submission_time (list(float)): Real times when trade is submitted to the RB from the MP.
+			d_time (numpy.ndarray): Real times when RB sends data points to the MP.
+			submission_time (numpy.ndarray): Real times when trade is submitted to the RB from the MP.
 			time_range (float): The time horizon being simulated.
 
 		Returns:
-			list(float): A total ordering of trades.
+			numpy.ndarray: A total ordering of trades.
+		"""
+		if self.backend == "reference":
+			return self.get_ordering_reference(d_time, submission_time, time_range)
+		d_time = np.asarray(d_time)
+		submission_time = np.asarray(submission_time)
+
+		# Index of the first data point delivered after each trade is submitted. The index never
+		# moves backwards and stays within `d_time`.
+		## With `inter_batch_time > 0`, pacing can deliver a data point before the last data point of the
+		## previous batch, so `d_time` is not always sorted. The first data point delivered after a time
+		## is also the first at which the running maximum of `d_time` exceeds it, and the running maximum
+		## is sorted, as `searchsorted` requires.
+		d_time_ind = np.searchsorted(np.maximum.accumulate(d_time), submission_time, side='right')
+		d_time_ind = np.minimum(np.maximum.accumulate(d_time_ind), len(d_time) - 1)
+
+		# Check if the submission time is within the delivery times of `d_time_ind-1` and `d_time_ind`.
+		# This is to ensure that the delivery clock is monotonically increasing. Skip checking for the last
+		# few data points as they are removed to not go beyond the time_range.
+		buffer = 100 * self.delta  # This multiplier can be adjusted
+		checked = submission_time < time_range - buffer
+		assert(np.all(submission_time[checked] >= d_time[d_time_ind[checked]-1]))
+		assert(np.all(submission_time[checked] < d_time[d_time_ind[checked]]))
+
+		# Delivery clock (x,t): x is (d_time_ind-1); t is (submission_time of trade - d_time of prev data point);
+		return (d_time_ind - 1) * time_range + submission_time - d_time[d_time_ind-1]
+
+	def get_ordering_reference(self, d_time, submission_time, time_range):
+		"""
+		Reference implementation of `get_ordering`, advancing the delivery clock one trade at a time.
 		"""
 		answer = []
 		d_time_ind = 0
@@ -110,24 +223,49 @@ class DBO(Algorithm):
 			answer.append((d_time_ind - 1) * time_range + submission_time[i]-d_time[d_time_ind-1])
 		return answer
 
-	def get_execution_time(self, ordering, ack_time_arr, time_range):
+	def get_ack_frontier(self, ack_time_arr):
+		"""
+		Get the global ACK frontier, i.e., for each data point, the real time when ACKs for it
+		have been received at the CES from all RBs. This only depends on the data point and is
+		calculated once for all MPs.
+
+		Args:
+			ack_time_arr (list(numpy.ndarray)): Real times when acks are received from all MPs.
+
+		Returns:
+			numpy.ndarray: Element-wise maximum of the ACK times across all RBs.
+		"""
+		ack_frontier = np.array(ack_time_arr[0], dtype=float)
+		for ack_time in ack_time_arr[1:]:
+			np.maximum(ack_frontier, ack_time, out=ack_frontier)
+		return ack_frontier
+
+	def get_execution_time(self, ordering, ack_frontier, time_range):
 		"""
 		Get the execution time of trades from a single MP.
 
 		For DBO, the trades are executed based on the delivery clock timestamps and when
 		the ACKs are received by the CES. Before a trade is executed, CES ensures that
 		delivery clocks on all RBs has reached the DC timestamp of the trade at least. This
-		is ensured using ACKs from all RBs.
+		is ensured using ACKs from all RBs (see `get_ack_frontier`).
 
 		Overriding the method from the super class (Algorithm).
 
 		Args:
-			ordering (list(float)): A total ordering of trades.
-			ack_time_arr (list(float)): Real times when acks are received from all MPs.
+			ordering (numpy.ndarray): A total ordering of trades.
+			ack_frontier (numpy.ndarray): Real times when acks for each data point are received from all MPs.
 			time_range (float): The time horizon being simulated.
 
 		Returns:
-			list(float): Real times of execution of trades from a single MP at the CES.
+			numpy.ndarray: Real times of execution of trades from a single MP at the CES.
+		"""
+		x = (np.asarray(ordering)/time_range).astype(int)
+		return ack_frontier[x+1]
+
+	def get_execution_time_reference(self, ordering, ack_time_arr, time_range):
+		"""
+		Reference implementation of `get_execution_time`, using the ACK times from all RBs
+		(`ack_time_arr`) instead of the global ACK frontier.
 		"""
 		answer = []
 		for i in range(len(ordering)):
@@ -138,26 +276,392 @@ class DBO(Algorithm):
 			answer.append(max_s)
 		return answer
 
+	def get_chunk_end(self, index):
+		"""
+		Get the end of a chunk of data points simulated by `run_streaming_simulation`. Chunks end at
+		the start of a batch, so that only the delivery time of the last batch is carried over.
+
+		Overriding the method from the super class (Algorithm).
+		"""
+		if index <= 0 or index >= len(self.g_time):
+			return min(max(index, 0), len(self.g_time))
+		length = 64
+		while True:
+			batch_number = (np.asarray(self.g_time[index-1:index-1+length])/self.batch_size).astype(int)
+			later = np.flatnonzero(batch_number != batch_number[0])
+			if len(later) > 0:
+				return index - 1 + int(later[0])
+			if index - 1 + length >= len(self.g_time):
+				return len(self.g_time)
+			length *= 2
+
+	def start_streaming_simulation(self):
+		## Delivery time of the last batch delivered by each RB.
+		self.last_batch_delivery_time = [-100]*self.number_participants
+
+	def simulate_chunk(self, st, en, la):
+		"""
+		Simulate the trades in response to the data points `st` to `en` (excluded) using the data
+		points up to `la` (excluded). Pacing continues from the last batch of the previous chunk. The
+		orderings are delivery clocks relative to data point `st`, which is the same for all MPs.
+
+		Overriding the method from the super class (Algorithm).
+		"""
+		g_time = np.asarray(self.g_time[st:la])
+		d_time_arr = []
+		ordering_arr = []
+		ack_time_arr = []
+		for i in range(self.number_participants):
+			r_time = self.get_chunk_r_time(i, st, la, g_time)
+			d_time_arr.append(self.run_stage("d_time", i, self.get_d_time, g_time, r_time, self.last_batch_delivery_time[i]))
+			submission_time = self.run_stage("submission", i, self.get_submission_time, d_time_arr[i][:en-st], self.response_times[i])
+			# Trades submitted after the last data point of the chunk and lookahead is delivered are ordered
+			# after later data points.
+			if la < len(self.g_time) and submission_time[-1] >= d_time_arr[i][-1]:
+				return None
+			## Receive times at the OB do not affect the ordering or execution of trades in DBO.
+			ordering_arr.append(self.run_stage("ordering", i, self.get_ordering, d_time_arr[i], submission_time, self.time_range))
+			ack_time_arr.append(self.run_stage("ack", i, self.get_receive_at_ob, d_time_arr[i], self.rv_owd_arr[i]))
+
+		ack_frontier = self.run_stage("ack_frontier", None, self.get_ack_frontier, ack_time_arr)
+		execution_time_arr = [self.run_stage("execution", i, self.get_execution_time, ordering_arr[i], ack_frontier, self.time_range)
+			for i in range(self.number_participants)]
+
+		# Carry over the delivery time of the last batch of the chunk, i.e., of its first data point.
+		batch_number = (g_time[:en-st]/self.batch_size).astype(int)
+		last_batch_start = np.searchsorted(batch_number, batch_number[-1], side='left')
+		for i in range(self.number_participants):
+			self.last_batch_delivery_time[i] = float(d_time_arr[i][last_batch_start])
+		return ordering_arr, execution_time_arr
+
+	def simulate_participant(self, i):
+		"""
+		Run the stages of MP`i` up to the ordering of its trades and the ACKs of its data points.
+
+		Overriding the method from the super class (Algorithm).
+		"""
+		# Calculate the times when the RB`i` receives the data points from the CES using the one way delays.
+		r_time = self.run_shared_stage("r_time", i, self.get_r_time, self.g_time, self.fw_owd_arr[i])
+		# Calculate when the data point is delivered by the RB`i` to the MP`i`.
+		d_time = self.run_stage("d_time", i, self.get_d_time, self.g_time, r_time)
+		return (r_time, d_time) + self.simulate_participant_trades(i, d_time)
+
+	def simulate_participant_trades(self, i, d_time):
+		"""
+		Run the stages of MP`i` after its data points are delivered, up to the ordering of its trades
+		and the ACKs of its data points.
+
+		Args:
+			i (int): Index of the MP.
+			d_time (numpy.ndarray): Real times when RB`i` sends data points to the MP`i`.
+
+		Returns:
+			tuple(numpy.ndarray): Submission, receive at OB, ordering and ACK times.
+		"""
+		# Calculate when trades are generated by MP`i` in response to the data points received and sent to the RB`i`.
+		submission_time = self.run_shared_stage("submission", i, self.get_submission_time, d_time, self.response_times[i])
+		# Calculate when trades are received at the OB from RB`i`.
+		receive_at_ob = self.run_shared_stage("receive_at_ob", i, self.get_receive_at_ob, submission_time, self.rv_owd_arr[i])
+		# Calculate the order of trades from RB`i` at the CES.
+		ordering = self.run_stage("ordering", i, self.get_ordering, d_time, submission_time, self.time_range)
+		# After each data point is delivered to the MP`i`, RB`i` sends an ACK to the CES.
+		# Calculate the times when the ACK reaches the CES.
+		ack_time = self.run_stage("ack", i, self.get_receive_at_ob, d_time, self.rv_owd_arr[i])
+		return submission_time, receive_at_ob, ordering, ack_time
+
 	def run_simulation(self):
 		## The environment should be set before calling this function.
+		self.run_participant_stages()
+		self.run_execution_stages()
+
+	def run_trade_stages(self):
+		"""
+		Run the stages of the simulation after the data points are delivered to the MPs, i.e., once
+		`d_time_arr` is set. `DBOGrid` sets the delivery times from intermediate results shared by a
+		grid of parameters and runs the remaining stages with this.
+		"""
 		for i in range(self.number_participants):
-			# Calculate the times when the RB`i` receives the data points from the CES using the one way delays.
-			self.r_time_arr.append(self.get_r_time(self.g_time, self.fw_owd_arr[i]))
-			# Calculate when the data point is delivered by the RB`i` to the MP`i`.
-			self.d_time_arr.append(self.get_d_time(self.g_time, self.r_time_arr[i]))
-			# Calculate when trades are generated by MP`i` in response to the data points received and sent to the RB`i`.
-			self.submission_time_arr.append(self.get_submission_time(self.d_time_arr[i], self.response_times[i]))
-			# Calculate when trades are received at the OB from RB`i`.
-			self.receive_at_ob_arr.append(self.get_receive_at_ob(self.submission_time_arr[i], self.rv_owd_arr[i]))
-			# Calculate the order of trades from RB`i` at the CES.
-			self.ordering_arr.append(self.get_ordering(self.d_time_arr[i], self.submission_time_arr[i], self.time_range))
-			# After each data point is delivered to the MP`i`, RB`i` sends an ACK to the CES.
-			# Calculate the times when the ACK reaches the CES.
-			self.ack_time_arr.append(self.get_receive_at_ob(self.d_time_arr[i], self.rv_owd_arr[i]))
+			for name, answer in zip(self.PARTICIPANT_ARRAYS[2:], self.simulate_participant_trades(i, self.d_time_arr[i])):
+				self.add_stage_result(name, i, answer)
+		self.run_execution_stages()
 
+	def run_execution_stages(self):
+		"""
+		Run the stages of the simulation which depend on all MPs, i.e., the execution of trades once
+		ACKs are received from all RBs, and record the latencies.
+		"""
+		if self.backend != "reference":
+			# Calculate when ACKs for each data point have been received from all RBs.
+			self.ack_frontier = self.run_stage("ack_frontier", None, self.get_ack_frontier, self.ack_time_arr)
+			self.release_stages("ack_time_arr")
 		for i in range(self.number_participants):
 			# Calculate the execution time of trades from RB`i` at the CES
-			self.execution_time_arr.append(self.get_execution_time(self.ordering_arr[i], self.ack_time_arr, self.time_range))
-			# Calculate the latency for each trade (ignore last 25/g_step points to ensure it is within `time_range`)
-			self.latency_arr.append(self.get_e2e_latency(
-				self.g_time, self.execution_time_arr[i], self.response_times[i])[:(-int((25.0/self.g_step) + 1))])
+			if self.backend == "reference":
+				execution_time = self.run_stage("execution", i, self.get_execution_time_reference, self.ordering_arr[i], self.ack_time_arr, self.time_range)
+			else:
+				execution_time = self.run_stage("execution", i, self.get_execution_time, self.ordering_arr[i], self.ack_frontier, self.time_range)
+			self.add_stage_result("execution_time_arr", i, execution_time)
+			# Calculate the latency for each trade.
+			self.run_stage("latency", i, self.record_participant_latency, i, execution_time)
+		self.release_stages()
+
+
+class DBOGrid(Algorithm):
+	"""
+	DBOGrid evaluates DBO for a grid of parameters `(delta, batch_size, inter_batch_time)` in the same
+	environment. Intermediate results which do not depend on all the parameters are calculated once
+	and shared: `r_time` for the environment, the batch completion times for each `batch_size`, and
+	the paced batch delivery times for each `(delta, batch_size)`. The combinations with the same delta
+	and batch size are then evaluated together (see `run_group`), with a leading axis of inter-batch
+	times, optionally in parallel.
+
+	The ordering of trades, the fairness counts and the latencies depend on all the parameters and take
+	most of the time of a DBO run. Evaluating them together removes the per-combination overhead, but
+	the work per trade remains, so a grid is only somewhat faster than separate runs of its combinations.
+	"""
+	## Columns of a row of `run_grid` results.
+	GRID_COLUMNS = ["delta", "batch_size", "inter_batch_time", "win_ratio", "lrtf_ratio", "mean_latency", "p99_latency", "max_latency"]
+	## Trades (combinations x MPs x data points) evaluated together by `run_group`. Each takes 8 bytes
+	## for each of the delivery times, orderings and execution times.
+	GROUP_TRADES = 1 << 24
+	PARTICIPANT_ARRAYS = ("r_time_arr",)
+	EXECUTION_INPUTS = ("r_time_arr",)
+
+	def __init__(self, deltas, batch_sizes, inter_batch_times):
+		"""
+		Args:
+			deltas (list(float)): Values of `delta` for DBO.
+			batch_sizes (list(float)): Values of `batch_size` for DBO.
+			inter_batch_times (list(float)): Values of `inter_batch_time` for DBO.
+		"""
+		## Combinations with the same batch size and delta are consecutive, so that only the intermediate
+		## results of the current batch size and delta are kept.
+		self.params = [(delta, batch_size, inter_batch_time) for batch_size, delta, inter_batch_time in itertools.product(batch_sizes, deltas, inter_batch_times)]
+		super().__init__()
+
+	def get_title(self):
+		return "DBOGrid({n})".format(n = len(self.params))
+
+	def reset_variables(self):
+		super().reset_variables()
+		self.shared_batches = (None, None)
+		self.shared_batch_delivery_time = (None, None)
+
+	def run_simulation(self):
+		"""
+		Calculate the intermediate results shared by all combinations of parameters. Use `run_grid`
+		to evaluate the combinations.
+		"""
+		## The environment should be set before calling this function.
+		self.run_participant_stages()
+
+	def simulate_participant(self, i):
+		# Calculate the times when the RB`i` receives the data points from the CES using the one way delays.
+		return (self.run_shared_stage("r_time", i, self.get_r_time, self.g_time, self.fw_owd_arr[i]),)
+
+	def get_shared_batches(self, batch_size):
+		"""
+		Get the batches and their completion times at each RB for a batch size. These are kept for the
+		last batch size used.
+
+		Returns:
+			tuple: Index of the first data point and number of data points of each batch, and the real
+				times when the batches are complete at each RB.
+		"""
+		if self.shared_batches[0] != batch_size:
+			dbo = DBO(batch_size=batch_size)
+			batch_starts, batch_counts = dbo.get_batches(self.g_time)
+			batch_complete_time = [dbo.get_batch_complete_time(r_time, batch_starts) for r_time in self.r_time_arr]
+			self.shared_batches = (batch_size, (batch_starts, batch_counts, batch_complete_time))
+		return self.shared_batches[1]
+
+	def get_shared_batch_delivery_time(self, delta, batch_size):
+		"""
+		Get the paced delivery times of the batches at each RB for a delta and batch size. These are
+		kept for the last delta and batch size used.
+
+		Returns:
+			list(list(float)): Real times when each RB delivers the batches to its MP.
+		"""
+		if self.shared_batch_delivery_time[0] != (delta, batch_size):
+			dbo = DBO(delta, batch_size)
+			batch_complete_time = self.get_shared_batches(batch_size)[2]
+			batch_delivery_time = [dbo.get_batch_delivery_time(complete_time) for complete_time in batch_complete_time]
+			self.shared_batch_delivery_time = ((delta, batch_size), batch_delivery_time)
+		return self.shared_batch_delivery_time[1]
+
+	def run_combination(self, k, lrtf_delta):
+		"""
+		Run the simulation for a combination of parameters, starting from the shared intermediate results.
+
+		Args:
+			k (int): Index of the combination in `params`.
+			lrtf_delta (float): The delta parameter for LRTF.
+
+		Returns:
+			tuple: Parameters and metrics of the combination (see `GRID_COLUMNS`). The metrics are NaN if
+				the combination cannot be simulated (see `is_simulated`).
+		"""
+		delta, batch_size, inter_batch_time = self.params[k]
+		sim_obj = DBO(delta, batch_size, inter_batch_time)
+		sim_obj.retention = "none"
+		sim_obj.set_simulation_environment(self.g_time, self.time_range, self.number_participants,
+			self.fw_owd_arr, self.rv_owd_arr, self.response_times, self.g_step)
+		sim_obj.r_time_arr = self.r_time_arr
+		batch_starts, batch_counts, _ = self.get_shared_batches(batch_size)
+		batch_delivery_time = self.get_shared_batch_delivery_time(delta, batch_size)
+		sim_obj.d_time_arr = [sim_obj.get_point_delivery_time(batch_starts, batch_counts, batch_delivery_time[i])
+			for i in range(self.number_participants)]
+		if not self.is_simulated(sim_obj.d_time_arr):
+			return (delta, batch_size, inter_batch_time) + (float('nan'),)*5
+		sim_obj.run_trade_stages()
+		return self.get_row(sim_obj, lrtf_delta)
+
+	def get_row(self, sim_obj, lrtf_delta):
+		"""
+		Get the parameters and metrics of a combination (see `GRID_COLUMNS`).
+
+		Args:
+			sim_obj (DBO): DBO for the combination, with its fairness counts and latency statistics.
+			lrtf_delta (float): The delta parameter for LRTF.
+
+		Returns:
+			tuple: Parameters and metrics of the combination.
+		"""
+		return (sim_obj.delta, sim_obj.batch_size, sim_obj.inter_batch_time,
+			float(sim_obj.get_win_fraction()),
+			float(sim_obj.get_lrtf_fariness_ratio(lrtf_delta)),
+			float(sim_obj.get_mean_latency()),
+			float(sim_obj.get_99p_latency()),
+			float(sim_obj.get_max_latency()))
+
+	def get_groups(self):
+		"""
+		Group the combinations of parameters with the same delta and batch size, which are consecutive
+		in `params`, up to `GROUP_TRADES` trades in a group.
+
+		Returns:
+			list(list(int)): Indices of the combinations in each group.
+		"""
+		group_size = max(1, self.GROUP_TRADES//(self.number_participants*len(self.g_time)))
+		groups = []
+		for k, (delta, batch_size, _) in enumerate(self.params):
+			if len(groups) > 0 and len(groups[-1]) < group_size and self.params[groups[-1][0]][:2] == (delta, batch_size):
+				groups[-1].append(k)
+			else:
+				groups.append([k])
+		return groups
+
+	def run_group(self, ks, lrtf_delta):
+		"""
+		Run the simulation for combinations of parameters with the same delta and batch size (see `get_groups`),
+		starting from the shared intermediate results. The stages broadcast over a leading axis of the
+		inter-batch times: the data points of all combinations are delivered by one pass over the paced
+		batch delivery times, the ACK frontiers and execution times are calculated together, and one pass
+		counts the ordered pairs of all combinations (see `Algorithm.count_ordered_pairs`). The results are
+		the same as with `run_combination`.
+
+		Args:
+			ks (list(int)): Indices of the combinations in `params`.
+			lrtf_delta (float): The delta parameter for LRTF.
+
+		Returns:
+			list(tuple): Parameters and metrics of each combination (see `run_combination`), in the order of `ks`.
+		"""
+		n = self.number_participants
+		delta, batch_size, _ = self.params[ks[0]]
+		dbo = DBO(delta, batch_size)
+		batch_starts, batch_counts, _ = self.get_shared_batches(batch_size)
+		batch_delivery_time = self.get_shared_batch_delivery_time(delta, batch_size)
+		# Deliver the data points of all combinations, with a row for each inter-batch time.
+		inter_batch_time = np.array([self.params[k][2] for k in ks], dtype=float)[:, None]
+		position_in_batch = np.arange(len(self.g_time)) - np.repeat(batch_starts, batch_counts)
+		d_time_arr = [np.repeat(batch_delivery_time[i], batch_counts) + position_in_batch*inter_batch_time for i in range(n)]
+		simulated = np.flatnonzero(self.is_simulated(d_time_arr))
+		rows = [self.params[k] + (float('nan'),)*5 for k in ks]
+		if len(simulated) == 0:
+			return rows
+
+		ordering_arr = []
+		ack_frontier = None
+		for i in range(n):
+			d_time = d_time_arr[i][simulated]
+			d_time_arr[i] = None
+			submission_time = dbo.get_submission_time(d_time, self.response_times[i])
+			ordering_arr.append(np.stack([dbo.get_ordering(d_time[j], submission_time[j], self.time_range) for j in range(len(simulated))]))
+			ack_time = dbo.get_receive_at_ob(d_time, self.rv_owd_arr[i])
+			ack_frontier = ack_time if ack_frontier is None else np.maximum(ack_frontier, ack_time, out=ack_frontier)
+
+		sim_objs = []
+		for j in simulated:
+			sim_obj = DBO(*self.params[ks[j]])
+			sim_obj.retention = "none"
+			sim_obj.set_simulation_environment(self.g_time, self.time_range, self.number_participants,
+				self.fw_owd_arr, self.rv_owd_arr, self.response_times, self.g_step)
+			sim_objs.append(sim_obj)
+		g_time = np.asarray(self.g_time)
+		## Ignore the latencies of the last 25/g_step points to ensure they are within `time_range`.
+		latency_end = len(self.g_time) - int((25.0/self.g_step) + 1)
+		for i in range(n):
+			execution_time = np.take_along_axis(ack_frontier, (ordering_arr[i]/self.time_range).astype(int) + 1, axis=1)
+			latency = dbo.get_e2e_latency(g_time, execution_time, self.response_times[i])
+			for j in range(len(simulated)):
+				sim_objs[j].record_latency(i, latency[j, :latency_end])
+		## Count the pairs of all combinations together, with the data points of each combination as a group.
+		ordered_pair_counts = self.count_ordered_pairs([ordering.ravel() for ordering in ordering_arr], len(self.g_time))
+		for j in range(len(simulated)):
+			sim_objs[j].ordered_pair_counts = ordered_pair_counts[j]
+			rows[simulated[j]] = self.get_row(sim_objs[j], lrtf_delta)
+		return rows
+
+	def is_simulated(self, d_time_arr):
+		"""
+		Check if a combination of parameters can be simulated from the delivery times of its data points.
+		The delivery clock should be monotonic, i.e., the data points of a batch are not paced beyond the
+		delivery of the next batch. The trades (and ACKs) should be sent within the one way delay traces,
+		i.e., pacing does not fall so far behind that they are sent after the end of the traces.
+
+		Args:
+			d_time_arr (list(numpy.ndarray)): Real times when each RB sends data points to its MP, optionally
+				with a leading axis of combinations (see `run_group`).
+
+		Returns:
+			numpy.ndarray: True if the combination can be simulated, for each combination.
+		"""
+		simulated = True
+		for i in range(self.number_participants):
+			d_time = np.asarray(d_time_arr[i])
+			simulated = simulated & ~np.any(np.diff(d_time, axis=-1) < 0, axis=-1)
+			# Trades are submitted after the data points are delivered, so the last trade is sent last.
+			if not isinstance(self.rv_owd_arr[i], InterpolatedDelay):
+				simulated = simulated & ((d_time[..., -1] + self.response_times[i]).astype(int) < len(self.rv_owd_arr[i]))
+		return simulated
+
+	def run_grid(self, lrtf_delta, max_workers=None):
+		"""
+		Evaluate all combinations of parameters. `run_simulation` should be called before this.
+
+		Args:
+			lrtf_delta (float): The delta parameter for LRTF.
+			max_workers (int, optional): Number of worker processes. Defaults to None, i.e., run in this process.
+
+		Returns:
+			list(tuple): Parameters and metrics of each combination (see `GRID_COLUMNS`), in the order of `params`.
+		"""
+		groups = self.get_groups()
+		if max_workers is None or max_workers <= 1 or len(groups) <= 1:
+			return [row for ks in groups for row in self.run_group(ks, lrtf_delta)]
+		with ProcessPoolExecutor(max_workers=max_workers, initializer=init_grid_worker, initargs=(self,)) as executor:
+			return [row for rows in executor.map(run_grid_worker_group, groups, [lrtf_delta]*len(groups)) for row in rows]
+
+
+## DBOGrid used by a worker process of `DBOGrid.run_grid`.
+grid_worker_state = {}
+
+
+def init_grid_worker(grid):
+	grid_worker_state["grid"] = grid
+
+
+def run_grid_worker_group(ks, lrtf_delta):
+	return grid_worker_state["grid"].run_group(ks, lrtf_delta)
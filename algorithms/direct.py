@@ -1,9 +1,13 @@
+import numpy as np
 from .algorithm import Algorithm
 
 class DirectDelivery(Algorithm):
 	"""
 	DirectDelivery implements the direct delivery of data with no buffering delays at RBs and OB.
 	"""
+	PARTICIPANT_ARRAYS = ("r_time_arr", "d_time_arr", "submission_time_arr", "receive_at_ob_arr", "ordering_arr", "execution_time_arr")
+	EXECUTION_INPUTS = ("execution_time_arr",)
+
 	def __init__(self):
 		super().__init__()
 
@@ -30,6 +34,17 @@ class DirectDelivery(Algorithm):
 		"""
 		return r_time
 
+	def get_stage_key(self, stage):
+		"""
+		Data points are delivered as soon as they are received at the RB, so the trades are submitted
+		and received at the OB at the same times for all algorithms which do so (e.g., `MaxRTT`).
+
+		Overriding the method from the super class (Algorithm).
+		"""
+		if stage in ("submission", "receive_at_ob"):
+			return ("delivery_on_receive",)
+		return super().get_stage_key(stage)
+
 	def get_ordering(self, receive_at_ob):
 		"""
 		Generate a total ordering of trades in which they can be executed.
@@ -64,21 +79,49 @@ class DirectDelivery(Algorithm):
 		"""
 		return receive_at_ob
 
+	def simulate_chunk(self, st, en, la):
+		"""
+		Simulate the trades in response to the data points `st` to `en` (excluded). The trades of
+		Direct Delivery only depend on their own data point, so no lookahead is used.
+
+		Overriding the method from the super class (Algorithm).
+		"""
+		g_time = np.asarray(self.g_time[st:en])
+		ordering_arr = []
+		execution_time_arr = []
+		for i in range(self.number_participants):
+			r_time = self.get_chunk_r_time(i, st, en, g_time)
+			d_time = self.run_stage("d_time", i, self.get_d_time, r_time)
+			submission_time = self.run_stage("submission", i, self.get_submission_time, d_time, self.response_times[i])
+			receive_at_ob = self.run_stage("receive_at_ob", i, self.get_receive_at_ob, submission_time, self.rv_owd_arr[i])
+			ordering_arr.append(self.run_stage("ordering", i, self.get_ordering, receive_at_ob))
+			execution_time_arr.append(self.run_stage("execution", i, self.get_execution_time, receive_at_ob))
+		return ordering_arr, execution_time_arr
+
+	def simulate_participant(self, i):
+		"""
+		Run the stages of MP`i` up to the execution of its trades, which do not depend on other MPs.
+
+		Overriding the method from the super class (Algorithm).
+		"""
+		# Calculate the times when the RB`i` receives the data points from the CES using the one way delays.
+		r_time = self.run_shared_stage("r_time", i, self.get_r_time, self.g_time, self.fw_owd_arr[i])
+		# Calculate when the data point is delivered by the RB`i` to the MP`i`.
+		d_time = self.run_stage("d_time", i, self.get_d_time, r_time)
+		# Calculate when trades are generated by MP`i` in response to the data points received and sent to the RB`i`.
+		submission_time = self.run_shared_stage("submission", i, self.get_submission_time, d_time, self.response_times[i])
+		# Calculate when trades are received at the OB from RB`i`.
+		receive_at_ob = self.run_shared_stage("receive_at_ob", i, self.get_receive_at_ob, submission_time, self.rv_owd_arr[i])
+		# Calculate the order of trades from RB`i` at the CES.
+		ordering = self.run_stage("ordering", i, self.get_ordering, receive_at_ob)
+		# Calculate the execution time of trades from RB`i` at the CES
+		execution_time = self.run_stage("execution", i, self.get_execution_time, receive_at_ob)
+		return r_time, d_time, submission_time, receive_at_ob, ordering, execution_time
+
 	def run_simulation(self):
 		## The environment should be set before calling this function.
+		self.run_participant_stages()
 		for i in range(self.number_participants):
-			# Calculate the times when the RB`i` receives the data points from the CES using the one way delays.
-			self.r_time_arr.append(self.get_r_time(self.g_time, self.fw_owd_arr[i]))
-			# Calculate when the data point is delivered by the RB`i` to the MP`i`.
-			self.d_time_arr.append(self.get_d_time(self.r_time_arr[i]))
-			# Calculate when trades are generated by MP`i` in response to the data points received and sent to the RB`i`.
-			self.submission_time_arr.append(self.get_submission_time(self.d_time_arr[i], self.response_times[i]))
-			# Calculate when trades are received at the OB from RB`i`.
-			self.receive_at_ob_arr.append(self.get_receive_at_ob(self.submission_time_arr[i], self.rv_owd_arr[i]))
-			# Calculate the order of trades from RB`i` at the CES.
-			self.ordering_arr.append(self.get_ordering(self.receive_at_ob_arr[i]))
-			# Calculate the execution time of trades from RB`i` at the CES
-			self.execution_time_arr.append(self.get_execution_time(self.receive_at_ob_arr[i]))
-			# Calculate the latency for each trade (ignore last 25/g_step points to ensure it is within `time_range`)
-			self.latency_arr.append(self.get_e2e_latency(
-				self.g_time, self.execution_time_arr[i], self.response_times[i])[:(-int((25.0/self.g_step) + 1))])
\ No newline at end of file
+			# Calculate the latency for each trade.
+			self.run_stage("latency", i, self.record_participant_latency, i, self.execution_time_arr[i])
+		self.release_stages()
\ No newline at end of file
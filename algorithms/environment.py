@@ -0,0 +1,76 @@
+import collections
+import numpy as np
+
+
+class SimulationEnvironment():
+	"""
+	Hold a simulation environment (generation times, one way delays and response times) shared by
+	several algorithms, and memoize the results of stages which are the same for these algorithms,
+	e.g., the times when the RBs receive the data points. Pass it to `Algorithm.set_simulation_environment`.
+
+	Stage results are keyed by the stage, the MP and the inputs of the stage which are not part of
+	the environment (see `Algorithm.get_stage_key`). The least recently used results are evicted once
+	they take more than `max_cache_bytes`. Cached arrays are read-only as they are shared.
+	"""
+	## Default limit on the memory taken by the cached stage results.
+	DEFAULT_MAX_CACHE_BYTES = 1 << 30
+
+	def __init__(self, g_time, time_range, number_participants, fw_owd_arr, rv_owd_arr, response_times, g_step=1, max_cache_bytes=None):
+		"""
+		Args:
+			g_time (list(float)): Real times when CES generates data points.
+			time_range (int): The time horizon being simulated.
+			number_participants (int): Number of MPs.
+			fw_owd_arr (list(numpy.ndarray)): One way delay from CES to RB at all times of horizon, `time_range`, for each RB.
+			rv_owd_arr (list(numpy.ndarray)): One way delay from RB to CES at all times on the horizon, `time_range`, for each RB.
+			response_times (list(float)): Response times of the various MPs.
+			g_step (int, optional): The frequency at which data is generated at the CES. Defaults to 1.
+			max_cache_bytes (int, optional): Limit on the memory taken by the cached stage results.
+				Defaults to `DEFAULT_MAX_CACHE_BYTES`.
+		"""
+		self.g_time = g_time if isinstance(g_time, range) else np.asarray(g_time)
+		self.time_range = time_range
+		self.number_participants = number_participants
+		self.fw_owd_arr = fw_owd_arr
+		self.rv_owd_arr = rv_owd_arr
+		self.response_times = response_times
+		self.g_step = g_step
+		self.max_cache_bytes = self.DEFAULT_MAX_CACHE_BYTES if max_cache_bytes is None else max_cache_bytes
+		self.cache = collections.OrderedDict()
+		self.cache_bytes = 0
+		self.hits = 0
+		self.misses = 0
+
+	def get_stage(self, key, function, *args):
+		"""
+		Get the result of a stage, calling `function(*args)` if it is not cached.
+
+		Args:
+			key (tuple): Identifies the stage and its inputs.
+			function (function): Function running the stage.
+
+		Returns:
+			numpy.ndarray: Result of the stage (read-only).
+		"""
+		if key in self.cache:
+			self.hits += 1
+			self.cache.move_to_end(key)
+			return self.cache[key]
+		self.misses += 1
+		answer = np.asarray(function(*args))
+		if answer.nbytes > self.max_cache_bytes:
+			return answer
+		answer.setflags(write=False)
+		self.cache[key] = answer
+		self.cache_bytes += answer.nbytes
+		while self.cache_bytes > self.max_cache_bytes:
+			_, evicted = self.cache.popitem(last=False)
+			self.cache_bytes -= evicted.nbytes
+		return answer
+
+	def clear_cache(self):
+		"""
+		Remove all cached stage results.
+		"""
+		self.cache.clear()
+		self.cache_bytes = 0
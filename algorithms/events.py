@@ -0,0 +1,39 @@
+import numpy as np
+
+
+class InterpolatedDelay():
+	"""
+	One way delays sampled at arbitrary times, e.g., at the data points of a cloud trace. The delay
+	at any time is linearly interpolated between the samples (and held constant before the first and
+	after the last sample).
+
+	Unlike a dense trace with one delay per time step, this does not need memory proportional to the
+	horizon, so it can be used to simulate sparse data generation (e.g., Poisson arrivals) over long
+	horizons. `Algorithm` looks up the delays at the times of the events only.
+
+	Note that DBO and MaxRTT execute a trade once the ACKs (heartbeats) for later data points are
+	received from all RBs. With sparse data generation, their latencies include the gaps between
+	data points, as no heartbeats are sent in between.
+	"""
+	def __init__(self, times, delays):
+		"""
+		Args:
+			times (numpy.ndarray): Increasing times (in us) at which the delays were sampled. For repeated
+				times, the first sample is used.
+			delays (numpy.ndarray): One way delays (in us) at `times`.
+		"""
+		times, ind = np.unique(np.asarray(times, dtype=float), return_index=True)
+		self.times = times
+		self.delays = np.asarray(delays, dtype=float)[ind]
+
+	def lookup(self, times):
+		"""
+		Get the one way delays at `times`.
+
+		Args:
+			times (numpy.ndarray): Real times (in us).
+
+		Returns:
+			numpy.ndarray: One way delays at `times`.
+		"""
+		return np.interp(times, self.times, self.delays)
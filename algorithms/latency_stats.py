@@ -0,0 +1,164 @@
+import numpy as np
+
+
+class LatencyStats():
+	"""
+	Accumulate end-to-end latency statistics without keeping the latencies of individual trades.
+
+	The count, sum, minimum and maximum are kept exactly. Percentiles are estimated from a histogram
+	whose bins are `resolution` wide up to `linear_limit`, so they are accurate to within `resolution`
+	there. Beyond `linear_limit` the bins grow geometrically (as in DDSketch), so they are accurate to
+	within a relative error of `resolution/linear_limit`, and the number of bins only grows with the
+	logarithm of the largest latency, e.g., when pacing falls behind. Two accumulators with the same
+	bins can be merged, e.g., across participants or worker processes.
+	"""
+	## Latency (in us) up to which the bins have a fixed width.
+	LINEAR_LIMIT = 1000.0
+
+	def __init__(self, resolution=0.01, linear_limit=LINEAR_LIMIT):
+		"""
+		Args:
+			resolution (float, optional): Width of the histogram bins (in us) up to `linear_limit`. Defaults to 0.01.
+			linear_limit (float, optional): Latency (in us) beyond which the bins grow geometrically. Defaults to `LINEAR_LIMIT`.
+		"""
+		self.resolution = resolution
+		self.linear_limit = linear_limit
+		## Bins `linear_bins`, `linear_bins+1`, ... cover [linear_limit*growth^k, linear_limit*growth^(k+1)),
+		## so that the first of them is `resolution` wide like the bins before.
+		self.linear_bins = int(np.ceil(linear_limit/resolution))
+		self.log_growth = np.log1p(resolution/linear_limit)
+		self.count = 0
+		self.total = 0.0
+		self.min = float('inf')
+		self.max = float('-inf')
+		## The histogram holds the counts of bins `offset`, `offset+1`, ... (see `get_bins`).
+		self.offset = 0
+		self.histogram = np.zeros(0, dtype=np.int64)
+
+	def get_bins(self, latencies):
+		"""
+		Get the histogram bins of latencies. Bin `b` covers [b*resolution, (b+1)*resolution) below
+		`linear_limit`, and the bins beyond it grow geometrically.
+
+		Args:
+			latencies (numpy.ndarray): End-to-end latencies of trades.
+
+		Returns:
+			numpy.ndarray: Bin of each latency.
+		"""
+		bins = np.floor(latencies/self.resolution).astype(np.int64)
+		beyond = latencies >= self.linear_bins*self.resolution
+		if np.any(beyond):
+			bins[beyond] = self.linear_bins + np.floor(np.log(latencies[beyond]/(self.linear_bins*self.resolution))/self.log_growth).astype(np.int64)
+		return bins
+
+	def get_bin_start(self, bins):
+		"""
+		Get the smallest latency in histogram bins (see `get_bins`).
+
+		Args:
+			bins (numpy.ndarray): Bin numbers.
+
+		Returns:
+			numpy.ndarray: Smallest latency of each bin.
+		"""
+		bins = np.asarray(bins, dtype=np.int64)
+		linear = bins*self.resolution
+		geometric = self.linear_bins*self.resolution*np.exp(np.maximum(bins - self.linear_bins, 0)*self.log_growth)
+		return np.where(bins < self.linear_bins, linear, geometric)
+
+	def add(self, latencies):
+		"""
+		Add the latencies of trades to the statistics.
+
+		Args:
+			latencies (numpy.ndarray): End-to-end latencies of trades.
+		"""
+		latencies = np.asarray(latencies, dtype=float).ravel()
+		if len(latencies) == 0:
+			return
+		self.count += len(latencies)
+		self.total += float(np.sum(latencies))
+		self.min = min(self.min, float(np.min(latencies)))
+		self.max = max(self.max, float(np.max(latencies)))
+		bins = self.get_bins(latencies)
+		offset = int(bins.min())
+		self.add_histogram(offset, np.bincount(bins - offset))
+
+	def add_histogram(self, offset, histogram):
+		"""
+		Add bin counts to the histogram, growing it if required.
+
+		Args:
+			offset (int): Bin number of the first entry of `histogram`.
+			histogram (numpy.ndarray): Number of latencies in each bin.
+		"""
+		if len(self.histogram) == 0:
+			self.offset = offset
+			self.histogram = np.array(histogram, dtype=np.int64)
+			return
+		start = min(self.offset, offset)
+		end = max(self.offset + len(self.histogram), offset + len(histogram))
+		if start != self.offset or end != self.offset + len(self.histogram):
+			grown = np.zeros(end - start, dtype=np.int64)
+			grown[self.offset-start:self.offset-start+len(self.histogram)] = self.histogram
+			self.offset = start
+			self.histogram = grown
+		self.histogram[offset-self.offset:offset-self.offset+len(histogram)] += histogram
+
+	def merge(self, other):
+		"""
+		Merge the statistics from another accumulator into this one.
+
+		Args:
+			other (LatencyStats): Statistics to merge. Must have the same `resolution` and `linear_limit`.
+
+		Returns:
+			LatencyStats: This accumulator.
+		"""
+		if (other.resolution, other.linear_limit) != (self.resolution, self.linear_limit):
+			raise ValueError("Cannot merge latency statistics with resolutions %f and %f and linear limits %f and %f" % (
+				self.resolution, other.resolution, self.linear_limit, other.linear_limit))
+		if other.count == 0:
+			return self
+		self.count += other.count
+		self.total += other.total
+		self.min = min(self.min, other.min)
+		self.max = max(self.max, other.max)
+		self.add_histogram(other.offset, other.histogram)
+		return self
+
+	def get_mean(self):
+		"""
+		Get the mean latency.
+		"""
+		if self.count == 0:
+			return float('nan')
+		return self.total/self.count
+
+	def get_max(self):
+		"""
+		Get the maximum latency.
+		"""
+		if self.count == 0:
+			return float('nan')
+		return self.max
+
+	def get_percentile(self, q):
+		"""
+		Estimate a percentile of the latencies. Like `numpy.percentile`, it linearly interpolates between
+		the two closest ranks; the latency at each rank is taken as the middle of its histogram bin.
+
+		Args:
+			q (float): Percentile to calculate, between 0 and 100.
+
+		Returns:
+			float: Estimated `q`th percentile latency.
+		"""
+		if self.count == 0:
+			return float('nan')
+		rank = (q/100.0)*(self.count - 1)
+		lower, upper = int(np.floor(rank)), int(np.ceil(rank))
+		bins = self.offset + np.searchsorted(np.cumsum(self.histogram), [lower, upper], side='right')
+		values = np.clip((self.get_bin_start(bins) + self.get_bin_start(bins + 1))/2, self.min, self.max)
+		return float(values[0] + (values[1] - values[0])*(rank - lower))
@@ -1,3 +1,4 @@
+import numpy as np
 from .dbo import DBO
 
 class MaxRTT(DBO):
@@ -6,6 +7,10 @@ class MaxRTT(DBO):
 	To minimize delay, there is no buffering at the RBs. MaxRTT assumes knowledge of trigger
 	points of the trades.
 	"""
+	## Number of trades whose heartbeats are looked up together; bounds the (RBs x trades) buffer.
+	HEARTBEAT_CHUNK_SIZE = 1 << 16
+	EXECUTION_INPUTS = ("ordering_arr", "d_time_arr", "ack_time_arr")
+
 	def __init__(self):
 		super().__init__()
 
@@ -15,6 +20,17 @@ class MaxRTT(DBO):
 	def get_d_time(self, g_time, r_time):
 		return r_time
 
+	def get_stage_key(self, stage):
+		"""
+		Data points are delivered as soon as they are received at the RB, so the trades are submitted
+		and received at the OB at the same times for all algorithms which do so (e.g., `DirectDelivery`).
+
+		Overriding the method from the super class (Algorithm).
+		"""
+		if stage in ("submission", "receive_at_ob"):
+			return ("delivery_on_receive",)
+		return super().get_stage_key(stage)
+
 	def get_ordering(self, d_time, submission_time, time_range):
 		"""
 		Generate a total ordering of trades in which they can be executed.
@@ -27,12 +43,22 @@ class MaxRTT(DBO):
 		Overriding the method from the super class (Algorithm).
 
 		Args:
-			d_time (list(float)): Real times when RB sends data points to the MP.
-			submission_time (list(float)): Real times when trade is submitted to the RB from the MP.
+			d_time (numpy.ndarray): Real times when RB sends data points to the MP.
+			submission_time (numpy.ndarray): Real times when trade is submitted to the RB from the MP.
 			time_range (float): The time horizon being simulated.
 
 		Returns:
-			list(float): A total ordering of trades.
+			numpy.ndarray: A total ordering of trades.
+		"""
+		if self.backend == "reference":
+			return self.get_ordering_reference(d_time, submission_time, time_range)
+		submission_time = np.asarray(submission_time)
+		rt = submission_time - np.asarray(d_time)
+		return np.arange(len(submission_time)) * time_range + rt
+
+	def get_ordering_reference(self, d_time, submission_time, time_range):
+		"""
+		Reference implementation of `get_ordering`.
 		"""
 		answer = []
 		for x in range(len(submission_time)):
@@ -53,13 +79,36 @@ class MaxRTT(DBO):
 		Overriding the method from the super class (Algorithm).
 
 		Args:
-			ordering (list(float)): A total ordering of trades.
-			d_time_arr (list(list(float))): Real times when RB sends data points to all MPs.
+			ordering (numpy.ndarray): A total ordering of trades.
+			d_time_arr (list(numpy.ndarray)): Real times when RB sends data points to all MPs.
 			time_range (float): The time horizon being simulated.
-			ack_time_arr (list(list(float))): Real times when acks are received from all MPs.
+			ack_time_arr (list(numpy.ndarray)): Real times when acks are received from all MPs.
 
 		Returns:
-			list(float): Real times of execution of trades from a single MP at the CES.
+			numpy.ndarray: Real times of execution of trades from a single MP at the CES.
+		"""
+		if self.backend == "reference":
+			return self.get_execution_time_reference(ordering, d_time_arr, time_range, ack_time_arr)
+		ordering = np.asarray(ordering)
+		answer = np.empty(len(ordering))
+		for st in range(0, len(ordering), self.HEARTBEAT_CHUNK_SIZE):
+			en = min(st + self.HEARTBEAT_CHUNK_SIZE, len(ordering))
+			x = (ordering[st:en]/time_range).astype(int)
+			rt = ordering[st:en]-np.arange(st, en)*time_range
+			heartbeat_ack = np.empty((len(d_time_arr), en - st))
+			for j in range(len(d_time_arr)):
+				d_time = np.asarray(d_time_arr[j])
+				# First heartbeat from RB`j` at or after `rt` has passed since delivery of data point `x`.
+				d_time_ind = np.searchsorted(d_time, d_time[x]+rt, side='left')
+				d_time_ind = np.minimum(np.maximum(d_time_ind, x), len(d_time) - 1)
+				heartbeat_ack[j] = np.asarray(ack_time_arr[j])[d_time_ind]
+			answer[st:en] = np.maximum(heartbeat_ack.max(axis=0), -1)
+		return answer
+
+	def get_execution_time_reference(self, ordering, d_time_arr, time_range, ack_time_arr):
+		"""
+		Reference implementation of `get_execution_time`, scanning forward through the heartbeats
+		of each RB for each trade.
 		"""
 		answer = []
 		for i in range(len(ordering)):
@@ -74,26 +123,53 @@ class MaxRTT(DBO):
 			answer.append(max_s)
 		return answer
 
-	def run_simulation(self):
-		## The environment should be set before calling this function.
+	def get_chunk_end(self, index):
+		## MaxRTT does not batch data points, so chunks can end anywhere.
+		return min(index, len(self.g_time))
+
+	def simulate_chunk(self, st, en, la):
+		"""
+		Simulate the trades in response to the data points `st` to `en` (excluded) using the data
+		points up to `la` (excluded) for the heartbeats. The orderings are relative to data point `st`,
+		which is the same for all MPs.
+
+		Overriding the method from the super class (Algorithm).
+		"""
+		g_time = np.asarray(self.g_time[st:la])
+		d_time_arr = []
+		ordering_arr = []
+		ack_time_arr = []
 		for i in range(self.number_participants):
-			# Calculate the times when the RB`i` receives the data points from the CES using the one way delays.
-			self.r_time_arr.append(self.get_r_time(self.g_time, self.fw_owd_arr[i]))
-			# Calculate when the data point is delivered by the RB`i` to the MP`i`.
-			self.d_time_arr.append(self.get_d_time(self.g_time, self.r_time_arr[i]))
-			# Calculate when trades are generated by MP`i` in response to the data points received and sent to the RB`i`.
-			self.submission_time_arr.append(self.get_submission_time(self.d_time_arr[i], self.response_times[i]))
-			# Calculate when trades are received at the OB from RB`i`.
-			self.receive_at_ob_arr.append(self.get_receive_at_ob(self.submission_time_arr[i], self.rv_owd_arr[i]))
-			# Calculate the order of trades from RB`i` at the CES.
-			self.ordering_arr.append(self.get_ordering(self.d_time_arr[i], self.submission_time_arr[i], self.time_range))
-			# After each data point is delivered to the MP`i`, RB`i` sends an ACK to the CES.
-			# Calculate the times when the ACK reaches the CES.
-			self.ack_time_arr.append(self.get_receive_at_ob(self.d_time_arr[i], self.rv_owd_arr[i]))
+			r_time = self.get_chunk_r_time(i, st, la, g_time)
+			d_time_arr.append(self.run_stage("d_time", i, self.get_d_time, g_time, r_time))
+			submission_time = self.run_stage("submission", i, self.get_submission_time, d_time_arr[i][:en-st], self.response_times[i])
+			## Receive times at the OB do not affect the ordering or execution of trades in MaxRTT.
+			ordering_arr.append(self.run_stage("ordering", i, self.get_ordering, d_time_arr[i][:en-st], submission_time, self.time_range))
+			ack_time_arr.append(self.run_stage("ack", i, self.get_receive_at_ob, d_time_arr[i], self.rv_owd_arr[i]))
+
+		# The trades of the last data point of the chunk wait for heartbeats sent up to the largest response
+		# time after it is delivered. These must be sent before the last data point of the lookahead is delivered.
+		if la < len(self.g_time):
+			last = en - st - 1
+			max_rt = max(float(np.max(ordering - np.arange(en - st)*self.time_range)) for ordering in ordering_arr)
+			if any(d_time[last] + max_rt > d_time[-1] for d_time in d_time_arr):
+				return None
+
+		execution_time_arr = [self.run_stage("execution", i, self.get_execution_time, ordering_arr[i], d_time_arr, self.time_range, ack_time_arr)
+			for i in range(self.number_participants)]
+		return ordering_arr, execution_time_arr
 
+	def run_execution_stages(self):
+		"""
+		Run the stages of the simulation which depend on all MPs, i.e., the execution of trades once
+		heartbeats are received from all RBs, and record the latencies.
+
+		Overriding the method from the super class (DBO).
+		"""
 		for i in range(self.number_participants):
 			# Calculate the execution time of trades from RB`i` at the CES
-			self.execution_time_arr.append(self.get_execution_time(self.ordering_arr[i], self.d_time_arr, self.time_range, self.ack_time_arr))
-			# Calculate the latency for each trade (ignore last 25/g_step points to ensure it is within `time_range`)
-			self.latency_arr.append(self.get_e2e_latency(
-				self.g_time, self.execution_time_arr[i], self.response_times[i])[:(-int((25.0/self.g_step) + 1))])
+			execution_time = self.run_stage("execution", i, self.get_execution_time, self.ordering_arr[i], self.d_time_arr, self.time_range, self.ack_time_arr)
+			self.add_stage_result("execution_time_arr", i, execution_time)
+			# Calculate the latency for each trade.
+			self.run_stage("latency", i, self.record_participant_latency, i, execution_time)
+		self.release_stages()
@@ -0,0 +1,118 @@
+import json
+import time
+import functools
+import tracemalloc
+
+
+class StageProfiler():
+	"""
+	Record the wall time and memory allocated by each stage of a simulation (for each MP) and
+	each metric. Memory is measured with `tracemalloc`, which also tracks NumPy arrays. Unless
+	tracing is already on, it is started for each measurement and stopped after it, so that it
+	does not slow down the process once profiling ends.
+	"""
+	def __init__(self, trace_memory=True):
+		"""
+		Args:
+			trace_memory (bool, optional): Measure allocated memory in addition to wall time. Defaults to True.
+		"""
+		self.trace_memory = trace_memory
+		self.records = []
+
+	def measure(self, stage, participant, function, *args):
+		"""
+		Call `function(*args)` and record the wall time taken and the memory allocated.
+
+		Args:
+			stage (str): Name of the stage or metric.
+			participant (int): Index of the MP the stage is run for, or None for metrics.
+			function (function): Function running the stage.
+
+		Returns:
+			Value returned by `function`.
+		"""
+		started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+		if started_tracing:
+			tracemalloc.start()
+		if self.trace_memory:
+			tracemalloc.reset_peak()
+			start_memory = tracemalloc.get_traced_memory()[0]
+		try:
+			start = time.perf_counter()
+			answer = function(*args)
+			record = {"stage": stage, "participant": participant, "seconds": time.perf_counter() - start}
+			if self.trace_memory:
+				memory, peak_memory = tracemalloc.get_traced_memory()
+				## Memory still held after the stage (e.g., its outputs) and the most held during the stage.
+				record["allocated_bytes"] = memory - start_memory
+				record["peak_bytes"] = peak_memory - start_memory
+		finally:
+			if started_tracing:
+				tracemalloc.stop()
+		self.records.append(record)
+		return answer
+
+	def get_report(self):
+		"""
+		Summarize the records for each stage, overall and for each MP.
+
+		Returns:
+			dict: For each stage, the number of calls, total wall time (s), total memory allocated
+				and the largest peak memory (bytes) of a call. Stages run for MPs also hold the same
+				summary for each MP under "participants".
+		"""
+		report = {}
+		for record in self.records:
+			summary = report.setdefault(record["stage"], new_summary())
+			add_to_summary(summary, record)
+			if record["participant"] is not None:
+				add_to_summary(summary.setdefault("participants", {}).setdefault(record["participant"], new_summary()), record)
+		return report
+
+	def write_json_lines(self, output_file_hndlr, **context):
+		"""
+		Write each record as a line of JSON.
+
+		Args:
+			output_file_hndlr (file): File to write the records to.
+			**context: Fields added to every record, e.g., the title of the algorithm.
+		"""
+		write_json_lines(self.records, output_file_hndlr, **context)
+
+
+def new_summary():
+	return {"calls": 0, "seconds": 0.0, "allocated_bytes": 0, "peak_bytes": 0}
+
+
+def add_to_summary(summary, record):
+	summary["calls"] += 1
+	summary["seconds"] += record["seconds"]
+	summary["allocated_bytes"] += record.get("allocated_bytes", 0)
+	summary["peak_bytes"] = max(summary["peak_bytes"], record.get("peak_bytes", 0))
+
+
+def write_json_lines(records, output_file_hndlr, **context):
+	"""
+	Write profiler records as lines of JSON.
+
+	Args:
+		records (list(dict)): Records of a `StageProfiler`.
+		output_file_hndlr (file): File to write the records to.
+		**context: Fields added to every record.
+	"""
+	for record in records:
+		print(json.dumps(dict(context, **record)), file=output_file_hndlr)
+	output_file_hndlr.flush()
+
+
+def profiled_metric(metric):
+	"""
+	Decorate a metric of `Algorithm` so that its calls are recorded by the profiler of the
+	algorithm when profiling is enabled.
+	"""
+	@functools.wraps(metric)
+	def wrapper(self, *args):
+		if not self.profile:
+			return metric(self, *args)
+		return self.profiler.measure(metric.__name__, None, metric, self, *args)
+	return wrapper
@@ -0,0 +1,90 @@
+import numpy as np
+
+
+class SimulationResults():
+	"""
+	Hold the times of each stage of a simulation for all MPs. With the numpy backend, each stage
+	is a contiguous (N, T) array with one row per MP, allocated when the result of the first MP
+	is added. The reference backend keeps a list with the result of each MP. Stages which are not
+	needed any more can be released (see `Algorithm.retention`).
+	"""
+	## Stage arrays of a simulation, as attributes of `Algorithm`.
+	STAGES = ("r_time_arr", "d_time_arr", "submission_time_arr", "receive_at_ob_arr", "ordering_arr", "ack_time_arr", "execution_time_arr", "latency_arr")
+	## Stages kept in float64 whatever the dtype: orderings such as the delivery clocks of DBO
+	## (x*time_range + t) need the precision to compare trades.
+	FULL_PRECISION_STAGES = ("ordering_arr",)
+
+	__slots__ = STAGES + ("dtype", "input_stages")
+
+	def __init__(self, dtype=np.float64, input_stages=()):
+		"""
+		Args:
+			dtype (numpy.dtype, optional): Type of the stage arrays, e.g., numpy.float32 to halve their memory. Defaults to numpy.float64.
+			input_stages (tuple(str), optional): Stages read back by later stages (e.g., `Algorithm.EXECUTION_INPUTS`),
+				which are also kept in float64 so that the metrics do not depend on the dtype. Defaults to ().
+		"""
+		self.dtype = dtype
+		self.input_stages = tuple(input_stages)
+		for stage in self.STAGES:
+			setattr(self, stage, [])
+
+	def get_dtype(self, stage):
+		"""
+		Get the type of a stage array.
+
+		Args:
+			stage (str): Name of the stage array, e.g., "r_time_arr".
+
+		Returns:
+			numpy.dtype: Type of the stage array.
+		"""
+		return np.float64 if stage in self.FULL_PRECISION_STAGES or stage in self.input_stages else self.dtype
+
+	def set_row(self, stage, i, number_participants, answer):
+		"""
+		Set the result of a stage for MP`i`, allocating the (N, T) array of the stage for the first MP.
+
+		Args:
+			stage (str): Name of the stage array, e.g., "r_time_arr".
+			i (int): Index of the MP.
+			number_participants (int): Number of MPs.
+			answer (numpy.ndarray): Result of the stage for MP`i`.
+		"""
+		arr = getattr(self, stage)
+		if not isinstance(arr, np.ndarray):
+			arr = np.empty((number_participants, len(answer)), dtype=self.get_dtype(stage))
+			setattr(self, stage, arr)
+		arr[i] = answer
+
+	def release(self, *stages):
+		"""
+		Release the arrays of stages which are not needed any more.
+		"""
+		for stage in stages:
+			setattr(self, stage, None)
+
+	def get_nbytes(self):
+		"""
+		Get the memory held by the stage arrays.
+
+		Returns:
+			int: Bytes held by the (N, T) arrays of the stages.
+		"""
+		return sum(getattr(self, stage).nbytes for stage in self.STAGES if isinstance(getattr(self, stage), np.ndarray))
+
+
+class StageAttribute():
+	"""
+	Attribute of an `Algorithm` for a stage array, which is held by the `SimulationResults` of the
+	algorithm (`results`), so that algorithms can use `self.r_time_arr` and so on.
+	"""
+	def __set_name__(self, owner, name):
+		self.name = name
+
+	def __get__(self, obj, objtype=None):
+		if obj is None:
+			return self
+		return getattr(obj.results, self.name)
+
+	def __set__(self, obj, value):
+		setattr(obj.results, self.name, value)
@@ -0,0 +1,243 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import resource
+import functools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from util import constant_delay, variable_delay_traces, OWDTrace
+from sweep import ALGORITHMS, get_response_times
+
+parser = argparse.ArgumentParser(description='Benchmark the simulator on synthetic traces.')
+parser.add_argument('--algorithms', '-a', type=str, nargs='+', default=list(ALGORITHMS), choices=list(ALGORITHMS), help='Algorithms to benchmark')
+parser.add_argument('--participants', '-n', type=int, nargs='+', default=[10, 30, 90], help='Numbers of participants')
+parser.add_argument('--time_ranges', '-t', type=int, nargs='+', default=[100000, 1000000], help='Time horizons (in us)')
+parser.add_argument('--mode', type=str, default="stream", choices=["stream", "all", "metrics", "none"], help='Run the simulation streamed as in the sweeps, or whole with this retention policy (see `Algorithm.RETENTION_POLICIES`)')
+parser.add_argument('--trace', type=str, default="variable", choices=["variable", "constant"], help='Synthetic RTT trace to use')
+parser.add_argument('--output', '-o', type=str, default="benchmark_results.json", help='File to save the results to (JSON)')
+parser.add_argument('--compare', '-c', type=str, default=None, help='Earlier results (JSON) to compare against')
+parser.add_argument('--threshold', type=float, default=1.2, help='Slowdown relative to --compare reported as a regression')
+
+## Parameters of the algorithms benchmarked (see `sweep.ALGORITHMS`).
+ALGORITHM_PARAMS = {
+	"DBO": (20, 25, 0),
+	"Cloudex": (15, 15),
+	"MaxRTT": (),
+	"DirectDelivery": (),
+}
+## Response times of the MPs are spread over [MIN_RT, MIN_RT + RT_RANGE) as in `run_simulation.py`.
+MIN_RT = 4
+RT_RANGE = 15.0
+DELTA = 20
+## Length of the synthetic RTT trace relative to the horizon. MPs use windows of twice the horizon.
+TRACE_LENGTH_FACTOR = 4
+## Stages faster than this (in s) are too noisy to be reported as regressions.
+MIN_COMPARED_SECONDS = 0.01
+
+
+@functools.lru_cache(maxsize=None)
+def get_synthetic_trace(trace, length):
+	"""
+	Get a synthetic RTT trace.
+
+	Args:
+		trace (str): "variable" for `util.variable_delay_traces` or "constant" for `util.constant_delay`.
+		length (int): Length of the trace.
+
+	Returns:
+		numpy.ndarray: RTTs over time.
+	"""
+	if trace == "constant":
+		return np.array(constant_delay(100, length))
+	return variable_delay_traces(20, 300, length, 1, 0)[0]
+
+
+def get_peak_rss_mb():
+	"""
+	Get the peak resident set size of this process (in MB).
+	"""
+	peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	## ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+	return peak_rss/(1024.0*1024.0) if sys.platform == "darwin" else peak_rss/1024.0
+
+
+def time_call(function):
+	"""
+	Call a function and measure the wall time taken.
+
+	Returns:
+		float: Wall time (in s).
+	"""
+	start = time.perf_counter()
+	function()
+	return time.perf_counter() - start
+
+
+def benchmark_configuration(algorithm, number_participants, time_range, trace, mode):
+	"""
+	Time a simulation and its metrics. This is run in a fresh process so that the peak RSS
+	belongs to this configuration only.
+
+	Args:
+		algorithm (str): Name of the algorithm in `sweep.ALGORITHMS`.
+		number_participants (int): Number of MPs.
+		time_range (int): The time horizon being simulated.
+		trace (str): Synthetic RTT trace to use (see `get_synthetic_trace`).
+		mode (str): "stream" for `run_streaming_simulation`, or the retention policy for `run_simulation`.
+
+	Returns:
+		list(dict): Results for the simulation and each metric.
+	"""
+	owd_trace = OWDTrace(get_synthetic_trace(trace, time_range*TRACE_LENGTH_FACTOR), time_range*2)
+	## Spread the windows of the MPs over the trace.
+	owd_arr = [owd_trace.get_window(i*(time_range*TRACE_LENGTH_FACTOR//number_participants)) for i in range(number_participants)]
+	g_time = np.arange(time_range)
+	sim_obj = ALGORITHMS[algorithm](*ALGORITHM_PARAMS[algorithm])
+	sim_obj.set_simulation_environment(g_time, time_range, number_participants, owd_arr, owd_arr,
+		get_response_times(number_participants, MIN_RT, RT_RANGE))
+	if mode != "stream":
+		sim_obj.retention = mode
+
+	def uncached(metric):
+		## Fairness counts are kept on the object; reset them so that each metric is timed in full,
+		## unless they were counted during the simulation and the orderings are not kept.
+		def call():
+			if mode in ("all", "metrics"):
+				sim_obj.ordered_pair_counts = None
+			metric()
+		return call
+
+	if mode == "stream":
+		timings = [("run_streaming_simulation", time_call(sim_obj.run_streaming_simulation))]
+	else:
+		timings = [("run_simulation", time_call(sim_obj.run_simulation))]
+	timings += [
+		("get_win_fraction", time_call(uncached(sim_obj.get_win_fraction))),
+		("get_lrtf_fariness_ratio", time_call(uncached(lambda: sim_obj.get_lrtf_fariness_ratio(DELTA)))),
+		("get_mean_latency", time_call(sim_obj.get_mean_latency)),
+		("get_50p_latency", time_call(lambda: sim_obj.get_latency_percentile(50))),
+		("get_99p_latency", time_call(sim_obj.get_99p_latency)),
+		("get_99.9p_latency", time_call(lambda: sim_obj.get_latency_percentile(99.9))),
+		("get_max_latency", time_call(sim_obj.get_max_latency)),
+	]
+	peak_rss_mb = get_peak_rss_mb()
+	trades = number_participants*time_range
+	return [{
+		"algorithm": sim_obj.get_title(),
+		"number_participants": number_participants,
+		"time_range": time_range,
+		"trace": trace,
+		"mode": mode,
+		"stage": stage,
+		"seconds": seconds,
+		"trades_per_sec": trades/seconds if seconds > 0 else float('inf'),
+		"peak_rss_mb": peak_rss_mb,
+	} for stage, seconds in timings]
+
+
+def run_configuration(algorithm, number_participants, time_range, trace, mode):
+	"""
+	Benchmark a configuration in a fresh process (see `benchmark_configuration`). If the process
+	fails, e.g., it runs out of memory and is killed, a single row recording the error is returned.
+
+	Returns:
+		list(dict): Results for each stage, or the failed row.
+	"""
+	try:
+		with ProcessPoolExecutor(max_workers=1) as executor:
+			return executor.submit(benchmark_configuration, algorithm, number_participants, time_range, trace, mode).result()
+	except Exception as error:
+		return [{
+			"algorithm": ALGORITHMS[algorithm](*ALGORITHM_PARAMS[algorithm]).get_title(),
+			"number_participants": number_participants,
+			"time_range": time_range,
+			"trace": trace,
+			"mode": mode,
+			"stage": "failed",
+			"error": repr(error),
+		}]
+
+
+def run_benchmarks(algorithms, participants, time_ranges, trace, mode):
+	"""
+	Benchmark all combinations of algorithms, numbers of participants and time horizons.
+
+	Returns:
+		list(dict): Results for each configuration and stage (see `run_configuration`).
+	"""
+	results = []
+	for time_range in time_ranges:
+		## Generate the trace once; worker processes forked below inherit the cached trace.
+		get_synthetic_trace(trace, time_range*TRACE_LENGTH_FACTOR)
+		for number_participants in participants:
+			for algorithm in algorithms:
+				rows = run_configuration(algorithm, number_participants, time_range, trace, mode)
+				for row in rows:
+					if "error" in row:
+						print("{algorithm},{number_participants},{time_range}: failed with {error}".format(**row), flush=True)
+					else:
+						print("{algorithm},{number_participants},{time_range},{stage}: {seconds:.3f} s, {trades_per_sec:.0f} trades/s, peak RSS {peak_rss_mb:.0f} MB".format(**row), flush=True)
+				results += rows
+	return results
+
+
+def compare_results(results, baseline, threshold):
+	"""
+	Compare benchmark results with earlier results.
+
+	Args:
+		results (list(dict)): Current results.
+		baseline (list(dict)): Earlier results.
+		threshold (float): Slowdown reported as a regression.
+
+	Returns:
+		list(str): Descriptions of the regressions.
+	"""
+	## Results saved before `--mode` was added ran the whole simulation keeping all stages.
+	key = lambda row: (row["algorithm"], row["number_participants"], row["time_range"], row["trace"], row.get("mode", "all"), row["stage"])
+	baseline = {key(row): row for row in baseline if "error" not in row}
+	regressions = []
+	for row in results:
+		if "error" in row or key(row) not in baseline:
+			continue
+		earlier = baseline[key(row)]
+		if max(row["seconds"], earlier["seconds"]) < MIN_COMPARED_SECONDS:
+			continue
+		slowdown = row["seconds"]/earlier["seconds"] if earlier["seconds"] > 0 else float('inf')
+		if slowdown > threshold:
+			regressions.append("{algorithm},{number_participants},{time_range},{stage}: {slowdown:.2f}x slower ({earlier:.3f} s -> {seconds:.3f} s)".format(
+				slowdown=slowdown, earlier=earlier["seconds"], **row))
+	return regressions
+
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	results = run_benchmarks(args.algorithms, args.participants, args.time_ranges, args.trace, args.mode)
+	report = {
+		"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"host": socket.gethostname(),
+		"platform": platform.platform(),
+		"python": platform.python_version(),
+		"numpy": np.__version__,
+		"cpu_count": os.cpu_count(),
+		"results": results,
+	}
+	with open(args.output, "w") as f:
+		json.dump(report, f, indent=1)
+	print("Results saved to %s" % args.output)
+	failed = [row for row in results if "error" in row]
+	if failed:
+		print("%d configurations failed" % len(failed))
+
+	if args.compare is not None:
+		with open(args.compare) as f:
+			regressions = compare_results(results, json.load(f)["results"], args.threshold)
+		for regression in regressions:
+			print("Regression: " + regression)
+		print("%d regressions compared to %s" % (len(regressions), args.compare))
+		sys.exit(1 if regressions or failed else 0)
+	sys.exit(1 if failed else 0)
@@ -0,0 +1,239 @@
+import sys
+import random
+import argparse
+import numpy as np
+from util import constant_delay, variable_delay
+from algorithms.dbo import DBO
+from algorithms.cloudex import Cloudex
+from algorithms.max_rtt import MaxRTT
+from algorithms.direct import DirectDelivery
+from algorithms.latency_stats import LatencyStats
+
+parser = argparse.ArgumentParser(description='Check the numpy backend of the algorithms against the reference backend.')
+parser.add_argument('--trials', '-n', type=int, default=20, help='Number of random environments')
+parser.add_argument('--seed', '-s', type=int, default=0, help='Seed for the random environments')
+parser.add_argument('--time_range', '-t', type=int, default=2000, help='Time horizon of each environment (in us)')
+
+## Stage arrays compared between the backends.
+STAGES = ["r_time_arr", "d_time_arr", "submission_time_arr", "receive_at_ob_arr", "ordering_arr", "ack_time_arr", "execution_time_arr", "latency_arr"]
+## Relative tolerance for the fairness ratios, which are summed in a different order by the backends.
+FAIRNESS_RTOL = 1e-12
+## Relative tolerance for the latency percentiles beyond the fixed width bins of `LatencyStats`.
+PERCENTILE_RTOL = Cloudex.LATENCY_RESOLUTION/LatencyStats.LINEAR_LIMIT
+## Latencies (in us) fed to `check_latency_stats`, spread as when pacing falls far behind, and the bytes
+## of histogram they may take.
+SPREAD_LATENCIES = (20, 500025)
+MAX_HISTOGRAM_BYTES = 1 << 23
+
+
+def random_environment(rng, time_range):
+	"""
+	Generate a random simulation environment with `util.variable_delay` or `util.constant_delay`
+	traces and random response times.
+
+	Args:
+		rng (random.Random): Random number generator.
+		time_range (int): The time horizon being simulated.
+
+	Returns:
+		tuple: Arguments of `Algorithm.set_simulation_environment`.
+	"""
+	number_participants = rng.randint(2, 8)
+	fw_owd_arr = []
+	response_times = []
+	for i in range(number_participants):
+		if rng.random() < 0.2:
+			trace = constant_delay(rng.uniform(5, 100), time_range*2)
+		else:
+			trace = variable_delay(rng.uniform(5, 50), rng.uniform(100, 300), time_range*2, rng.randrange(1 << 30))
+		fw_owd_arr.append(np.array(trace))
+		## Round some response times to create ties.
+		response_time = rng.uniform(1, 20)
+		response_times.append(round(response_time) if rng.random() < 0.3 else response_time)
+	g_time = list(range(time_range))
+	return g_time, time_range, number_participants, fw_owd_arr, fw_owd_arr, response_times
+
+
+def random_algorithms(rng):
+	"""
+	Get algorithms with random parameters to compare.
+
+	Args:
+		rng (random.Random): Random number generator.
+
+	Returns:
+		list(function): Functions constructing the algorithms.
+	"""
+	delta = rng.randint(5, 30)
+	batch_size = rng.randint(delta, 40)
+	## Batches paced within delta keep the delivery times increasing. Larger inter-batch times can
+	## deliver a data point before the last data point of the previous batch.
+	inter_batch_time = rng.choice([0, 0, (delta - 1)/batch_size, rng.uniform(0, 3)])
+	dd = rng.randint(5, 100)
+	return [
+		lambda: DBO(delta, batch_size, inter_batch_time),
+		lambda: Cloudex(dd, dd),
+		lambda: MaxRTT(),
+		lambda: DirectDelivery(),
+	]
+
+
+def first_divergence(reference, fast):
+	"""
+	Find the first index at which two stage arrays differ.
+
+	Args:
+		reference (list(list(float))): Stage array from the reference backend, for each MP.
+		fast (list(numpy.ndarray)): Stage array from the numpy backend, for each MP.
+
+	Returns:
+		str: Description of the first difference, or None if the arrays are identical.
+	"""
+	if len(reference) != len(fast):
+		return "%d MPs instead of %d" % (len(fast), len(reference))
+	for i in range(len(reference)):
+		ref = np.asarray(reference[i], dtype=float)
+		arr = np.asarray(fast[i], dtype=float)
+		if ref.shape != arr.shape:
+			return "MP %d: length %d instead of %d" % (i, len(arr), len(ref))
+		diverging = np.flatnonzero(ref != arr)
+		if len(diverging) > 0:
+			k = diverging[0]
+			return "MP %d, index %d: %r instead of %r" % (i, k, float(arr[k]), float(ref[k]))
+	return None
+
+
+def compare(make_algorithm, environment):
+	"""
+	Run an algorithm with both backends in the same environment and compare the stage arrays
+	and metrics, and check that the metrics of the numpy backend are the same with float32 stage arrays. The backends also agree if both fail a check of the simulation (an AssertionError),
+	e.g., a delivery clock which is not monotonic.
+
+	Args:
+		make_algorithm (function): Function constructing the algorithm.
+		environment (tuple): Arguments of `Algorithm.set_simulation_environment`.
+
+	Returns:
+		list(str): Descriptions of the differences between the backends.
+	"""
+	sim_objs = {}
+	errors = {}
+	for backend in ["reference", "numpy"]:
+		sim_obj = make_algorithm()
+		sim_obj.backend = backend
+		sim_obj.set_simulation_environment(*environment)
+		try:
+			sim_obj.run_simulation()
+		except AssertionError as error:
+			errors[backend] = error
+		sim_objs[backend] = sim_obj
+	if len(errors) == 2:
+		return []
+	if len(errors) == 1:
+		backend, error = errors.popitem()
+		return ["only the %s backend failed a check: %r" % (backend, error)]
+	reference, fast = sim_objs["reference"], sim_objs["numpy"]
+
+	differences = []
+	for stage in STAGES:
+		divergence = first_divergence(getattr(reference, stage), getattr(fast, stage))
+		if divergence is not None:
+			differences.append("%s: %s" % (stage, divergence))
+
+	metrics = [("win fraction", lambda x: x.get_win_fraction(), FAIRNESS_RTOL, 0)]
+	for delta in sorted(set(reference.response_times)):
+		## LRTF is only defined if some MP is faster than delta.
+		if min(reference.response_times) < delta:
+			metrics.append(("LRTF ratio (delta=%r)" % delta, lambda x, delta=delta: x.get_lrtf_fariness_ratio(delta), FAIRNESS_RTOL, 0))
+	metrics += [
+		("mean latency", lambda x: x.get_mean_latency(), 1e-12, 0),
+		("p50 latency", lambda x: x.get_latency_percentile(50), PERCENTILE_RTOL, fast.LATENCY_RESOLUTION),
+		("p99 latency", lambda x: x.get_99p_latency(), PERCENTILE_RTOL, fast.LATENCY_RESOLUTION),
+		("max latency", lambda x: x.get_max_latency(), 0, 0),
+	]
+	for name, metric, rtol, atol in metrics:
+		expected, actual = metric(reference), metric(fast)
+		if not np.isclose(actual, expected, rtol=rtol, atol=atol):
+			differences.append("%s: %r instead of %r" % (name, actual, expected))
+
+	## Narrowing the stage arrays which are only outputs should not change the metrics.
+	narrow = make_algorithm()
+	narrow.result_dtype = np.float32
+	narrow.set_simulation_environment(*environment)
+	narrow.run_simulation()
+	for name, metric, _, _ in metrics:
+		expected, actual = metric(fast), metric(narrow)
+		if actual != expected:
+			differences.append("%s with float32 stage arrays: %r instead of %r" % (name, actual, expected))
+	return differences
+
+
+def check_latency_stats(seed, length=1000000, chunks=8):
+	"""
+	Check that the latency statistics stay small for latencies spread over `SPREAD_LATENCIES`, and that
+	their percentiles, merged from chunks, match `numpy.percentile`.
+
+	Args:
+		seed (int): Seed for the latencies.
+		length (int, optional): Number of latencies. Defaults to 1000000.
+		chunks (int, optional): Number of accumulators merged. Defaults to 8.
+
+	Returns:
+		list: Descriptions of the differences found.
+	"""
+	rng = np.random.default_rng(seed)
+	latencies = np.exp(rng.uniform(*np.log(SPREAD_LATENCIES), length))
+	stats = LatencyStats(Cloudex.LATENCY_RESOLUTION)
+	for chunk in np.array_split(latencies, chunks):
+		chunk_stats = LatencyStats(Cloudex.LATENCY_RESOLUTION)
+		chunk_stats.add(chunk)
+		stats.merge(chunk_stats)
+
+	differences = []
+	if stats.histogram.nbytes > MAX_HISTOGRAM_BYTES:
+		differences.append("latency histogram takes %d bytes" % stats.histogram.nbytes)
+	for q in [0, 1, 50, 99, 99.9, 100]:
+		expected, actual = np.percentile(latencies, q), stats.get_percentile(q)
+		if not np.isclose(actual, expected, rtol=PERCENTILE_RTOL, atol=Cloudex.LATENCY_RESOLUTION):
+			differences.append("p%r latency: %r instead of %r" % (q, actual, expected))
+	return differences
+
+
+def run_differential(trials, seed, time_range):
+	"""
+	Compare the backends of all algorithms on random environments.
+
+	Args:
+		trials (int): Number of random environments.
+		seed (int): Seed for the random environments.
+		time_range (int): The time horizon of each environment.
+
+	Returns:
+		int: Number of runs in which the backends differ.
+	"""
+	rng = random.Random(seed)
+	failures = 0
+	for trial in range(trials):
+		environment = random_environment(rng, time_range)
+		for make_algorithm in random_algorithms(rng):
+			title = make_algorithm().get_title()
+			differences = compare(make_algorithm, environment)
+			if differences:
+				failures += 1
+				print("Trial %d, %s, %d MPs, response times %s:" % (trial, title, environment[2], environment[5]))
+				for difference in differences:
+					print("    " + difference)
+			else:
+				print("Trial %d, %s, %d MPs: OK" % (trial, title, environment[2]))
+	return failures
+
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+	failures = run_differential(args.trials, args.seed, args.time_range)
+	differences = check_latency_stats(args.seed)
+	for difference in differences:
+		print("Latency statistics: " + difference)
+	failures += 1 if differences else 0
+	print("%d runs differ between the backends" % failures)
+	sys.exit(1 if failures else 0)
@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import socket
+import traceback
+from concurrent.futures import wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from util import read_cloud_trace, data_generation, get_file_digest, OWDTrace
+from sweep import Configuration, get_configuration_description, get_jobs, create_worker_pool, run_worker_job
+from results_store import get_configuration_key, format_result
+
+## Bump when the layout of the manifest or the job files changes.
+MANIFEST_VERSION = 1
+## Directories of a queue: jobs waiting to be claimed, jobs claimed by a worker, and the results of jobs.
+PENDING_DIR = "pending"
+CLAIMED_DIR = "claimed"
+RESULTS_DIR = "results"
+## A job running in a pool whose worker process died (e.g., killed when out of memory) is returned to
+## the pending jobs, as another job may have killed the worker, until it was in this many broken pools.
+MAX_BROKEN_POOLS = 2
+
+
+def get_worker_id():
+	"""
+	Get an identifier of this worker process which is unique across hosts.
+	"""
+	return "%s-%d" % (socket.gethostname(), os.getpid())
+
+
+def write_json(filename, data):
+	"""
+	Write JSON to a file atomically, so that readers never see a partial file.
+
+	Args:
+		filename (str): Name of the file.
+		data: Data to write.
+	"""
+	with open(filename + ".tmp", "w") as f:
+		json.dump(data, f)
+	os.replace(filename + ".tmp", filename)
+
+
+def read_json(filename):
+	with open(filename) as f:
+		return json.load(f)
+
+
+def create_queue(queue_dir, configurations, time_range, g_step, trace_info, pending=None):
+	"""
+	Create a queue of simulation jobs in a directory shared by the hosts running the workers (see
+	`run_queue_worker`). The manifest lists the configurations with everything their results depend
+	on, and each job (see `sweep.get_jobs`) is a file in the pending directory.
+
+	Args:
+		queue_dir (str): Directory of the queue. It should not hold another queue.
+		configurations (list(sweep.Configuration)): Configurations to simulate, in the order their results are merged.
+		time_range (int): The time horizon being simulated.
+		g_step (int): The frequency at which data is generated at the CES.
+		trace_info (dict): Identifies the RTT trace: the digest of the trace file, the MP and the section
+			used (see `load_latency_trace`).
+		pending (list(int), optional): Indices of the configurations to simulate. Defaults to all.
+
+	Returns:
+		int: Number of jobs in the queue.
+	"""
+	if os.path.exists(os.path.join(queue_dir, "manifest.json")):
+		raise ValueError("%s already holds a queue" % queue_dir)
+	for directory in (PENDING_DIR, CLAIMED_DIR, RESULTS_DIR):
+		os.makedirs(os.path.join(queue_dir, directory), exist_ok=True)
+	pending = range(len(configurations)) if pending is None else pending
+	jobs = get_jobs(configurations, pending)
+	## Jobs are written before the manifest, so that workers only start on a complete queue.
+	for k, job in enumerate(jobs):
+		write_json(os.path.join(queue_dir, PENDING_DIR, "job-%06d.json" % k), {"configurations": job})
+	write_json(os.path.join(queue_dir, "manifest.json"), {
+		"version": MANIFEST_VERSION,
+		"time_range": time_range,
+		"g_step": g_step,
+		"trace": trace_info,
+		"configurations": [dict(configuration._asdict(), params=list(configuration.params)) for configuration in configurations],
+	})
+	return len(jobs)
+
+
+def read_manifest(queue_dir):
+	"""
+	Read the manifest of a queue.
+
+	Args:
+		queue_dir (str): Directory of the queue.
+
+	Returns:
+		dict: Manifest of the queue, with the configurations as `sweep.Configuration`s.
+	"""
+	manifest = read_json(os.path.join(queue_dir, "manifest.json"))
+	if manifest["version"] != MANIFEST_VERSION:
+		raise ValueError("Unsupported manifest version %s in %s" % (manifest["version"], queue_dir))
+	manifest["configurations"] = [Configuration(**dict(configuration, params=tuple(configuration["params"])))
+		for configuration in manifest["configurations"]]
+	return manifest
+
+
+def load_latency_trace(trace_filename, trace_info):
+	"""
+	Read the section of the cloud trace used by the simulations of a queue. The trace file may be
+	at a different path on each host, but should have the same contents.
+
+	Args:
+		trace_filename (str): Name of the cloud trace file.
+		trace_info (dict): Digest of the trace file, the MP and the section used (see `create_queue`).
+
+	Returns:
+		numpy.ndarray: RTTs over time used for all RBs.
+	"""
+	if get_file_digest(trace_filename) != trace_info["digest"]:
+		raise ValueError("%s is not the trace file the queue was created with" % trace_filename)
+	cloud_trace = read_cloud_trace(trace_filename)
+	return data_generation(cloud_trace, [trace_info["mp_id"]], trace_info["start"], trace_info["end"])[0]
+
+
+def claim_job(queue_dir):
+	"""
+	Claim a pending job by moving it to the claimed directory. The move is an atomic rename, so
+	each job is claimed by a single worker even if workers on several hosts try at once.
+
+	Args:
+		queue_dir (str): Directory of the queue.
+
+	Returns:
+		str: Name of the job, or None if there are no pending jobs left.
+	"""
+	for name in sorted(os.listdir(os.path.join(queue_dir, PENDING_DIR))):
+		if not name.endswith(".json"):
+			continue
+		try:
+			os.rename(os.path.join(queue_dir, PENDING_DIR, name), os.path.join(queue_dir, CLAIMED_DIR, name))
+		except FileNotFoundError:
+			## Another worker claimed the job first.
+			continue
+		return name
+	return None
+
+
+def release_job(queue_dir, name):
+	"""
+	Return a claimed job to the pending jobs.
+
+	Args:
+		queue_dir (str): Directory of the queue.
+		name (str): Name of the job.
+	"""
+	os.rename(os.path.join(queue_dir, CLAIMED_DIR, name), os.path.join(queue_dir, PENDING_DIR, name))
+
+
+def run_queue_worker(queue_dir, latency_trace, max_workers=None):
+	"""
+	Claim and run jobs from a queue until there are no pending jobs left, in a pool of worker
+	processes on this host. A job is only claimed once a worker process is free, so that jobs are
+	spread over the hosts. The results of each job are written to a file of its own in the results
+	directory. A job which fails is recorded with its error instead.
+
+	If a worker process dies, the pool is started again and the jobs running in it are returned to
+	the pending jobs, unless they were already running in `MAX_BROKEN_POOLS` broken pools, in which
+	case they are recorded as failed.
+
+	Args:
+		queue_dir (str): Directory of the queue.
+		latency_trace (numpy.ndarray): RTTs over time used for all RBs (see `load_latency_trace`).
+		max_workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+
+	Returns:
+		int: Number of jobs run.
+	"""
+	manifest = read_manifest(queue_dir)
+	configurations = manifest["configurations"]
+	time_range, g_step = manifest["time_range"], manifest["g_step"]
+	owd_trace = OWDTrace(latency_trace, int(time_range*2))
+	worker_id = get_worker_id()
+	max_workers = max_workers or os.cpu_count()
+	executor, shm = create_worker_pool(owd_trace, time_range, g_step, max_workers)
+	count = 0
+	try:
+		futures = {}
+		while True:
+			while len(futures) < max_workers:
+				name = claim_job(queue_dir)
+				if name is None:
+					break
+				job_file = read_json(os.path.join(queue_dir, CLAIMED_DIR, name))
+				try:
+					future = executor.submit(run_worker_job, [configurations[i] for i in job_file["configurations"]])
+				except BrokenProcessPool:
+					## A worker process died after the last jobs completed.
+					release_job(queue_dir, name)
+					executor, shm = restart_worker_pool(executor, shm, owd_trace, time_range, g_step, max_workers)
+					continue
+				futures[future] = (name, job_file, time.time(), executor)
+			if len(futures) == 0:
+				break
+			done, _ = wait(futures, return_when=FIRST_COMPLETED)
+			broken = False
+			for future in done:
+				name, job_file, start, job_executor = futures.pop(future)
+				job = job_file["configurations"]
+				output = {"worker": worker_id, "configurations": job}
+				try:
+					job_results, _ = future.result()
+					output["results"] = []
+					for i, result in zip(job, job_results):
+						description = get_configuration_description(configurations[i], manifest["trace"], time_range, g_step)
+						output["results"].append({"key": get_configuration_key(description), "description": description, "result": list(result)})
+						print(format_result(result), flush=True)
+				except BrokenProcessPool:
+					broken = broken or job_executor is executor
+					job_file["broken_pools"] = job_file.get("broken_pools", 0) + 1
+					if job_file["broken_pools"] < MAX_BROKEN_POOLS:
+						write_json(os.path.join(queue_dir, CLAIMED_DIR, name), job_file)
+						release_job(queue_dir, name)
+						print("Job %s was running when a worker process died; returned it to the pending jobs" % name, flush=True)
+						continue
+					output["error"] = traceback.format_exc()
+					print("Job %s failed:\n%s" % (name, output["error"]), flush=True)
+				except Exception:
+					output["error"] = traceback.format_exc()
+					print("Job %s failed:\n%s" % (name, output["error"]), flush=True)
+				output["seconds"] = time.time() - start
+				write_json(os.path.join(queue_dir, RESULTS_DIR, name), output)
+				count += 1
+			if broken:
+				executor, shm = restart_worker_pool(executor, shm, owd_trace, time_range, g_step, max_workers)
+	finally:
+		executor.shutdown()
+		shm.close()
+		shm.unlink()
+	return count
+
+
+def restart_worker_pool(executor, shm, owd_trace, time_range, g_step, max_workers):
+	"""
+	Shut down a pool of worker processes in which a worker died, and start a new one.
+
+	Returns:
+		tuple: The new pool of worker processes and its shared memory (see `sweep.create_worker_pool`).
+	"""
+	print("A worker process died; starting the worker processes again", flush=True)
+	executor.shutdown()
+	shm.close()
+	shm.unlink()
+	return create_worker_pool(owd_trace, time_range, g_step, max_workers)
+
+
+def requeue_claimed_jobs(queue_dir):
+	"""
+	Move the claimed jobs without results back to the pending jobs, e.g., after a worker was killed.
+	Only use this when no workers are running, as running jobs are requeued as well.
+
+	Args:
+		queue_dir (str): Directory of the queue.
+
+	Returns:
+		int: Number of jobs requeued.
+	"""
+	count = 0
+	for name in sorted(os.listdir(os.path.join(queue_dir, CLAIMED_DIR))):
+		if name.endswith(".json") and not os.path.exists(os.path.join(queue_dir, RESULTS_DIR, name)):
+			os.rename(os.path.join(queue_dir, CLAIMED_DIR, name), os.path.join(queue_dir, PENDING_DIR, name))
+			count += 1
+	return count
+
+
+def merge_results(queue_dir, output_file_hndlr, store=None):
+	"""
+	Merge the results of the jobs of a queue in the order of the configurations in the manifest,
+	in the format of `traces/simulation.dat`. Configurations without results (jobs which are still
+	pending, running or failed) are skipped and reported.
+
+	Args:
+		queue_dir (str): Directory of the queue.
+		output_file_hndlr (file): File to write the results to.
+		store (results_store.ResultsStore, optional): Store to add the results to. Results already in
+			the store are used for configurations without results in the queue. Defaults to None.
+
+	Returns:
+		list(int): Indices of the configurations without results.
+	"""
+	manifest = read_manifest(queue_dir)
+	results = {}
+	for name in sorted(os.listdir(os.path.join(queue_dir, RESULTS_DIR))):
+		if not name.endswith(".json"):
+			continue
+		output = read_json(os.path.join(queue_dir, RESULTS_DIR, name))
+		if "error" in output:
+			print("Job %s failed on %s" % (name, output["worker"]))
+			continue
+		for row in output["results"]:
+			results[row["key"]] = tuple(row["result"])
+			if store is not None:
+				store.put(row["key"], row["description"], row["result"])
+
+	missing = []
+	for i, configuration in enumerate(manifest["configurations"]):
+		key = get_configuration_key(get_configuration_description(configuration, manifest["trace"], manifest["time_range"], manifest["g_step"]))
+		result = results.get(key)
+		if result is None and store is not None:
+			result = store.get(key)
+		if result is None:
+			missing.append(i)
+			continue
+		print(format_result(result), file=output_file_hndlr)
+	return missing
@@ -0,0 +1,244 @@
+import time
+import heapq
+import asyncio
+import argparse
+import numpy as np
+from util import variable_delay_traces
+from algorithms.dbo import DBO
+
+parser = argparse.ArgumentParser(description='Replay DBO with the RBs and the OB running as concurrent tasks, and check it against the offline simulation.')
+parser.add_argument('--num_p', '-n', type=int, default=10, help='Number of participants')
+parser.add_argument('--delta', '-d', type=float, default=20, help='Delta for DBO (in us)')
+parser.add_argument('--batch_size', '-b', type=int, default=25, help='Batch size for DBO (in us)')
+parser.add_argument('--inter_batch_time', '-i', type=float, default=0, help='Inter-batch time for DBO (in us)')
+parser.add_argument('--time_range', '-t', type=int, default=20000, help='Time horizon (in us)')
+parser.add_argument('--seed', '-s', type=int, default=0, help='Seed for the synthetic RTT traces')
+
+## Response times of the MPs are spread over [MIN_RT, MAX_RT) as in `single_run.py`.
+MAX_RT = 19
+MIN_RT = 4
+## Range of the synthetic RTTs (in us).
+SYNTHETIC_MIN_RTT = 20
+SYNTHETIC_MAX_RTT = 300
+
+
+class DBOReplay():
+	"""
+	DBOReplay runs DBO with the CES, each RB and the OB as concurrent asyncio tasks exchanging messages
+	over queues, instead of calculating each stage for all data points from arrays (see `algorithms.dbo.DBO`).
+	The CES task sends the data points to the RB tasks. Each RB task batches and paces the data points,
+	delivers them to its MP, sends ACKs for them to the OB and stamps the trades of its MP with delivery
+	clocks. The OB task buffers the trades and releases them in delivery clock order once the ACKs from
+	all RBs cover them.
+
+	Simulated time is taken from the one way delays and the tasks advance it as fast as they can, so the
+	replay measures the trades per second the OB sustains. Each RB handles its events (deliveries and
+	trade submissions) in simulated time order, up to the receive time of the last data point received,
+	as later data points may add earlier events. An RB sends the trades stamped with a delivery clock `x`
+	before the ACK of data point `x+1`, so the OB has all trades up to `x` once the ACKs of `x+1` are in.
+	"""
+	## Number of messages a queue between the tasks holds; producers wait when it is full.
+	QUEUE_SIZE = 1024
+	## Kinds of the events of an RB. Deliveries at the same time as a submission are handled first.
+	DELIVERY = 0
+	SUBMISSION = 1
+
+	def __init__(self, delta=0, batch_size=0, inter_batch_time=0):
+		self.delta = delta
+		self.batch_size = batch_size
+		self.inter_batch_time = inter_batch_time
+
+	def get_title(self):
+		return "DBOReplay({delta}|{bs}|{ibt})".format(delta = self.delta, bs = self.batch_size, ibt = self.inter_batch_time)
+
+	def set_simulation_environment(self, g_time, time_range, number_participants, fw_owd_arr, rv_owd_arr, response_times, g_step=1):
+		"""
+		Set the simulation environment (see `Algorithm.set_simulation_environment`). The one way delays
+		should be dense arrays.
+		"""
+		self.g_time = np.asarray(g_time)
+		self.time_range = time_range
+		self.number_participants = number_participants
+		self.fw_owd_arr = fw_owd_arr
+		self.rv_owd_arr = rv_owd_arr
+		self.response_times = response_times
+		self.g_step = g_step
+
+	def run_replay(self):
+		"""
+		Run the replay. The ordering and execution time of each trade are kept in `ordering_arr` and
+		`execution_time_arr` (NaN for the trades submitted after the last data point is delivered, which
+		are never covered by ACKs).
+
+		Returns:
+			dict: Trades released, wall time (s), sustained trades per second, the number of trades
+				buffered at the OB (mean and max) and the processing latency at the OB, from receiving a
+				trade to releasing it (us, p50, p99 and max).
+		"""
+		n, length = self.number_participants, len(self.g_time)
+		self.ordering_arr = np.full((n, length), np.nan)
+		self.execution_time_arr = np.full((n, length), np.nan)
+		## Orderings of the trades in the order they are released.
+		self.release_ordering = []
+		self.processing_latency = []
+		self.buffer_depth = []
+		start = time.perf_counter()
+		asyncio.run(self.run_tasks())
+		seconds = time.perf_counter() - start
+		processing_latency = np.array(self.processing_latency)*1e6
+		return {
+			"trades": len(self.release_ordering),
+			"seconds": seconds,
+			"trades_per_sec": len(self.release_ordering)/seconds,
+			"mean_buffered": float(np.mean(self.buffer_depth)),
+			"max_buffered": int(np.max(self.buffer_depth)),
+			"p50_processing_us": float(np.percentile(processing_latency, 50)),
+			"p99_processing_us": float(np.percentile(processing_latency, 99)),
+			"max_processing_us": float(np.max(processing_latency)),
+		}
+
+	async def run_tasks(self):
+		self.rb_queues = [asyncio.Queue(self.QUEUE_SIZE) for _ in range(self.number_participants)]
+		self.ob_queue = asyncio.Queue(self.QUEUE_SIZE)
+		await asyncio.gather(self.run_ces(), self.run_ob(), *[self.run_rb(i) for i in range(self.number_participants)])
+
+	async def run_ces(self):
+		"""
+		Send the data points to all RBs, marking the last data point of each batch.
+		"""
+		batch_number = (self.g_time/self.batch_size).astype(int).tolist()
+		g_time = self.g_time.tolist()
+		for k in range(len(g_time)):
+			last_in_batch = k == len(g_time) - 1 or batch_number[k+1] != batch_number[k]
+			for rb_queue in self.rb_queues:
+				await rb_queue.put((k, g_time[k], last_in_batch))
+		for rb_queue in self.rb_queues:
+			await rb_queue.put(None)
+
+	async def run_rb(self, i):
+		"""
+		Run RB`i`: batch and pace the data points received, deliver them to MP`i`, send an ACK to the OB
+		for each data point delivered, and stamp the trades of MP`i` with delivery clocks and send them
+		to the OB.
+		"""
+		fw_owd, rv_owd, response_time = self.fw_owd_arr[i], self.rv_owd_arr[i], self.response_times[i]
+		d_time = [0.0]*len(self.g_time)
+		## Events of the RB as (time, kind, data point).
+		events = []
+		batch = []
+		batch_complete_time = -np.inf
+		last_batch_delivery_time = -100
+		last_delivered = -1
+		while True:
+			message = await self.rb_queues[i].get()
+			if message is not None:
+				k, g_time, last_in_batch = message
+				r_time = g_time + float(fw_owd[int(g_time)])
+			# Handle the events before the data point is received (all events after the last data point).
+			until = r_time if message is not None else np.inf
+			while len(events) > 0 and events[0][0] < until:
+				event_time, kind, x = heapq.heappop(events)
+				if kind == self.DELIVERY:
+					d_time[x] = event_time
+					last_delivered = x
+					await self.ob_queue.put(("ack", i, x, event_time + float(rv_owd[int(event_time)])))
+					heapq.heappush(events, (event_time + response_time, self.SUBMISSION, x))
+				else:
+					# Delivery clock (x,t) of the trade: x is the last data point delivered; t is the time since it was delivered.
+					ordering = last_delivered*self.time_range + event_time - d_time[last_delivered]
+					await self.ob_queue.put(("trade", i, x, last_delivered, ordering))
+			if message is None:
+				break
+
+			batch.append(k)
+			batch_complete_time = max(batch_complete_time, r_time)
+			if last_in_batch:
+				# Deliver the batch when it is complete or delta after the last batch, whichever is later.
+				batch_delivery_time = max(batch_complete_time, last_batch_delivery_time + self.delta)
+				for j in range(len(batch)):
+					heapq.heappush(events, (batch_delivery_time + j*self.inter_batch_time, self.DELIVERY, batch[j]))
+				last_batch_delivery_time = batch_delivery_time
+				batch = []
+				batch_complete_time = -np.inf
+		await self.ob_queue.put(("done", i))
+
+	async def run_ob(self):
+		"""
+		Run the OB: buffer the trades and release them in delivery clock order once ACKs from all
+		RBs cover them. A trade with delivery clock (x,t) is executed when the ACKs of data point `x+1`
+		have been received from all RBs.
+		"""
+		n = self.number_participants
+		ack_frontier = np.full(len(self.g_time), -np.inf)
+		ack_count = np.zeros(len(self.g_time), dtype=int)
+		## All RBs have ACKed the data points up to `covered`.
+		covered = -1
+		## Trades waiting for ACKs as (ordering, delivery clock x, MP, data point, wall time received).
+		buffer = []
+		done = 0
+		while done < n:
+			message = await self.ob_queue.get()
+			if message[0] == "trade":
+				_, i, k, x, ordering = message
+				heapq.heappush(buffer, (ordering, x, i, k, time.perf_counter()))
+			elif message[0] == "ack":
+				_, i, k, ack_time = message
+				ack_frontier[k] = max(ack_frontier[k], ack_time)
+				ack_count[k] += 1
+				while covered + 1 < len(ack_count) and ack_count[covered + 1] == n:
+					covered += 1
+			else:
+				done += 1
+			self.buffer_depth.append(len(buffer))
+
+			# Release the trades covered by the ACKs, in delivery clock order.
+			while len(buffer) > 0 and buffer[0][1] + 1 <= covered:
+				ordering, x, i, k, received = heapq.heappop(buffer)
+				self.processing_latency.append(time.perf_counter() - received)
+				self.release_ordering.append(ordering)
+				self.ordering_arr[i, k] = ordering
+				self.execution_time_arr[i, k] = ack_frontier[x+1]
+
+	def check(self):
+		"""
+		Check the replay against the offline simulation of DBO with the same parameters and environment:
+		the orderings (`DBO.get_ordering`) and execution times (`DBO.get_execution_time`) of the trades
+		released, and that trades are released in delivery clock order. `run_replay` should be called before this.
+
+		Returns:
+			dict: Number of trades compared, trades with a different ordering or execution time, and trades
+				released after a trade ordered behind them.
+		"""
+		dbo = DBO(self.delta, self.batch_size, self.inter_batch_time)
+		dbo.set_simulation_environment(self.g_time, self.time_range, self.number_participants,
+			self.fw_owd_arr, self.rv_owd_arr, self.response_times, self.g_step)
+		dbo.run_simulation()
+		released = ~np.isnan(self.ordering_arr)
+		return {
+			"compared": int(np.count_nonzero(released)),
+			"ordering_mismatches": int(np.count_nonzero(self.ordering_arr[released] != np.asarray(dbo.ordering_arr)[released])),
+			"execution_mismatches": int(np.count_nonzero(self.execution_time_arr[released] != np.asarray(dbo.execution_time_arr)[released])),
+			"out_of_order": int(np.count_nonzero(np.diff(self.release_ordering) < 0)),
+		}
+
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	time_range = args.time_range
+	g_time = np.arange(time_range)
+	## Each participant has its own synthetic trace; forward and reverse paths are symmetric.
+	owd_arr = list(variable_delay_traces(SYNTHETIC_MIN_RTT, SYNTHETIC_MAX_RTT, time_range*2, args.num_p, args.seed)/2)
+	response_time_arr = [int(MIN_RT)+(args.num_p-i-1)*((MAX_RT-MIN_RT)/args.num_p) for i in range(args.num_p)]
+
+	replay = DBOReplay(args.delta, args.batch_size, args.inter_batch_time)
+	replay.set_simulation_environment(g_time, time_range, args.num_p, owd_arr, owd_arr, response_time_arr)
+	print("Replaying %s for %d MPs over %d us" % (replay.get_title(), args.num_p, time_range))
+	stats = replay.run_replay()
+	print("Released %d trades in %.2f s: %.0f trades/s" % (stats["trades"], stats["seconds"], stats["trades_per_sec"]))
+	print("Trades buffered at the OB: mean %.1f, max %d" % (stats["mean_buffered"], stats["max_buffered"]))
+	print("Processing latency at the OB: p50 %.1f us, p99 %.1f us, max %.1f us" % (stats["p50_processing_us"], stats["p99_processing_us"], stats["max_processing_us"]))
+
+	check = replay.check()
+	print("Compared %d trades with the offline simulation: %d ordering mismatches, %d execution time mismatches, %d released out of order" % (
+		check["compared"], check["ordering_mismatches"], check["execution_mismatches"], check["out_of_order"]))
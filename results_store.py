@@ -0,0 +1,98 @@
+import json
+import hashlib
+import sqlite3
+
+## Columns of a row of results, in the order of `traces/simulation.dat`.
+RESULT_COLUMNS = ["title", "number_participants", "win_ratio", "lrtf_ratio", "mean_latency", "p99_latency", "max_latency"]
+
+
+def get_configuration_key(description):
+	"""
+	Get the key of a simulation configuration in the results store.
+
+	Args:
+		description (dict): Everything the results of a simulation depend on, e.g., the algorithm
+			title and parameters, number of MPs, response times, trace digest and offsets, and `time_range`.
+
+	Returns:
+		str: SHA-256 digest of the canonical JSON encoding of `description`.
+	"""
+	return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+class ResultsStore():
+	"""
+	SQLite database of simulation results keyed by a hash of the simulation configuration (see
+	`get_configuration_key`). Results are committed as soon as they are added, so an interrupted
+	sweep can be resumed by skipping the configurations which already have results.
+	"""
+	def __init__(self, filename):
+		"""
+		Args:
+			filename (str): Name of the database file. It is created if it does not exist.
+		"""
+		self.filename = filename
+		self.connection = sqlite3.connect(filename)
+		self.connection.execute(
+			"CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, description TEXT, title TEXT, number_participants INTEGER, "
+			"win_ratio REAL, lrtf_ratio REAL, mean_latency REAL, p99_latency REAL, max_latency REAL)")
+		self.connection.commit()
+
+	def __contains__(self, key):
+		return self.connection.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone() is not None
+
+	def get(self, key):
+		"""
+		Get the results of a configuration.
+
+		Args:
+			key (str): Key of the configuration.
+
+		Returns:
+			tuple: Results in the order of `RESULT_COLUMNS`, or None if there are no results.
+		"""
+		return self.connection.execute("SELECT %s FROM results WHERE key = ?" % ", ".join(RESULT_COLUMNS), (key,)).fetchone()
+
+	def put(self, key, description, result):
+		"""
+		Add (or replace) the results of a configuration.
+
+		Args:
+			key (str): Key of the configuration.
+			description (dict): Description of the configuration the key was calculated from.
+			result (tuple): Results in the order of `RESULT_COLUMNS`.
+		"""
+		self.connection.execute(
+			"INSERT OR REPLACE INTO results (key, description, %s) VALUES (?, ?, %s)" % (", ".join(RESULT_COLUMNS), ", ".join("?"*len(RESULT_COLUMNS))),
+			(key, json.dumps(description, sort_keys=True)) + tuple(result))
+		self.connection.commit()
+
+	def export_csv(self, keys, output_file_hndlr):
+		"""
+		Write the results of the configurations in the format of `traces/simulation.dat`.
+		Configurations without results are skipped.
+
+		Args:
+			keys (list(str)): Keys of the configurations, in the order the rows are written.
+			output_file_hndlr (file): File to write the results to.
+		"""
+		for key in keys:
+			result = self.get(key)
+			if result is not None:
+				print(format_result(result), file=output_file_hndlr)
+
+	def close(self):
+		self.connection.close()
+
+
+def format_result(result):
+	"""
+	Format results as a row of `traces/simulation.dat`.
+
+	Args:
+		result (tuple): Results in the order of `RESULT_COLUMNS`.
+
+	Returns:
+		str: Row with the title of the algorithm, number of MPs, fairness ratios and latencies.
+	"""
+	return ",".join(str(x) for x in result)
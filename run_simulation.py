@@ -1,99 +1,87 @@
-import numpy as np
 import sys
+import numpy as np
+import argparse
 from matplotlib import pyplot as plt
 import matplotlib
-from util import read_cloud_trace, data_generation, generate_random_trace
-from traces.trace_indices import rand_idx1
-from algorithms.dbo import DBO
-from algorithms.cloudex import Cloudex
-from algorithms.max_rtt import MaxRTT
+from util import read_cloud_trace, data_generation, get_file_digest
+from sweep import Configuration, run_sweep, get_configuration_description
+from results_store import ResultsStore, get_configuration_key, format_result
+from job_queue import create_queue, merge_results
 
 matplotlib.rcParams['pdf.fonttype'] = 42
 matplotlib.rcParams['ps.fonttype'] = 42
 
-cloud_trace = read_cloud_trace("traces/direct.zip")
-rtt_arrs = data_generation(cloud_trace)
-output_file = open("traces/simulation.dat", "a")
-
-##   Use only a section of trace from MP1.
-#### Use trace starting at index `trace_dd_idx`. This value was chosen randomly.
-#### Fixed to this value to reproduce the figures.
-mp1_rtt_trace = np.array(rtt_arrs[0])
-trace_dd_idx = 53927275
-latency_trace = mp1_rtt_trace[trace_dd_idx-150000:trace_dd_idx+1850000]
-
-## Plot the network trace used.
-fig, ax = plt.subplots(figsize=(8, 2.2))
-plt.plot(np.arange(0, latency_trace.shape[0], 1)*0.001,latency_trace)
-plt.xlabel("Time (ms)", fontsize=16)
-plt.ylabel(r"Latency $(\mu s)$", fontsize=15)
-plt.ylim(bottom=0, top=600)
-plt.tight_layout()
-plt.show()
-# fig.savefig("figures/network_rtt_trace.pdf", bbox_inches='tight', dpi=450)
-fig.savefig("figures/network_rtt_trace.png", bbox_inches='tight', dpi=450)
-
+parser = argparse.ArgumentParser(description='Run simulations for the figures in the paper.')
+parser.add_argument('--workers', '-w', type=int, default=None, help='Number of worker processes (defaults to the number of CPUs)')
+parser.add_argument('--trace', '-t', type=str, default="traces/direct.zip", help='Cloud trace file to use')
+parser.add_argument('--store', '-s', type=str, default="traces/simulation.sqlite", help='Results store; configurations with results in it are not simulated again')
+parser.add_argument('--profile', '-p', type=str, default=None, help='Profile the stages of each simulation and append the records to this file (JSON lines)')
+parser.add_argument('--queue', '-q', type=str, default=None, help='Instead of simulating, create a queue of jobs in this (shared) directory for sweep_worker.py')
+parser.add_argument('--merge', '-m', type=str, default=None, help='Instead of simulating, merge the results of the queue in this directory')
 
 RT = 4
+RT_RANGE = 15.0
 DELTA = 20
 BATCH_SIZE = 25
 g_step = 1
 time_range = 1000000
-g_time = []
-for i in range(int(time_range/g_step)):
-	g_time.append(i*g_step)
 
-dbo_obj = DBO(DELTA, BATCH_SIZE, 0)
-max_rtt_obj = MaxRTT()
+## The configurations simulated, in the order the results are written.
+SWEEP = []
+for number_participant in range(10, 100, 10):
+	SWEEP.append(Configuration("DBO", (DELTA, BATCH_SIZE, 0), number_participant, RT, RT_RANGE, DELTA))
+	SWEEP.append(Configuration("MaxRTT", (), number_participant, RT, RT_RANGE, DELTA))
+for number_participant in [10, 60]:
+	for dd in sorted(list(range(10, 360, 10))+[15]):
+		SWEEP.append(Configuration("Cloudex", (dd, dd), number_participant, RT, RT_RANGE, DELTA))
+
+if __name__ == "__main__":
+	args = parser.parse_args()
 
-def print_stats(sim_obj, output_file_hndlr=sys.stdout, delta=DELTA):
-	print("{algorithm},{num_p},{win_ratio},{lrtf_ratio},{mean_l},{p99_l},{max_l}".format(
-		algorithm=sim_obj.get_title(),
-		num_p=number_participant,
-		win_ratio=sim_obj.get_win_fraction(),
-		lrtf_ratio=sim_obj.get_lrtf_fariness_ratio(delta),
-		mean_l=sim_obj.get_mean_latency(),
-		p99_l=sim_obj.get_99p_latency(),
-		max_l=sim_obj.get_max_latency()),
-		flush=True, file=output_file_hndlr)
+	if args.merge is not None:
+		## Export the results of the queue for `plot_figures.py`, and keep them in the results store.
+		store = ResultsStore(args.store)
+		with open("traces/simulation.dat", "w") as output_file:
+			missing = merge_results(args.merge, output_file, store)
+		store.close()
+		print("Merged the results of %s into traces/simulation.dat; %d configurations without results" % (args.merge, len(missing)))
+		sys.exit(0)
 
+	##   Use only a section of trace from MP1.
+	#### Use trace starting at index `trace_dd_idx`. This value was chosen randomly.
+	#### Fixed to this value to reproduce the figures.
+	trace_dd_idx = 53927275
+	trace_info = {"digest": get_file_digest(args.trace), "mp_id": 1, "start": trace_dd_idx-150000, "end": trace_dd_idx+1850000}
 
-for number_participant in range(10, 100, 10):
-	fw_owd_arr = []
-	rv_owd_arr = []
-	response_time_arr = []
-	for i in range(number_participant):
-		response_time_arr.append(int(RT)+(number_participant-i-1)*(15.0/number_participant))
-		temp_rtt_trace = generate_random_trace(latency_trace, rand_idx1[i], int(time_range*2))
-		fw_owd_arr.append([x/2 for x in temp_rtt_trace])
-		rv_owd_arr.append([x/2 for x in temp_rtt_trace])
+	if args.queue is not None:
+		## Configurations with results in the store are not queued; the merge takes their results from the store.
+		store = ResultsStore(args.store)
+		pending = [i for i in range(len(SWEEP)) if get_configuration_key(get_configuration_description(SWEEP[i], trace_info, time_range, g_step)) not in store]
+		store.close()
+		number_jobs = create_queue(args.queue, SWEEP, time_range, g_step, trace_info, pending)
+		print("Created %d jobs for %d configurations in %s" % (number_jobs, len(pending), args.queue))
+		print("Run `python3 sweep_worker.py %s` on each host, then `python3 run_simulation.py --merge %s`" % (args.queue, args.queue))
+		sys.exit(0)
 
-	print("Running DBO for %d MPs" % number_participant)
-	dbo_obj.set_simulation_environment(g_time, time_range, number_participant, fw_owd_arr, rv_owd_arr, response_time_arr, g_step)
-	dbo_obj.run_simulation()
-	print_stats(dbo_obj)
-	print_stats(dbo_obj, output_file)
+	cloud_trace = read_cloud_trace(args.trace)
+	latency_trace = data_generation(cloud_trace, [1], trace_dd_idx-150000, trace_dd_idx+1850000)[0]
 
-	print("Running MaxRTT for %d MPs" % number_participant)
-	max_rtt_obj.set_simulation_environment(g_time, time_range, number_participant, fw_owd_arr, rv_owd_arr, response_time_arr, g_step)
-	max_rtt_obj.run_simulation()
-	print_stats(max_rtt_obj)
-	print_stats(max_rtt_obj, output_file)
+	## Plot the network trace used.
+	fig, ax = plt.subplots(figsize=(8, 2.2))
+	plt.plot(np.arange(0, latency_trace.shape[0], 1)*0.001,latency_trace)
+	plt.xlabel("Time (ms)", fontsize=16)
+	plt.ylabel(r"Latency $(\mu s)$", fontsize=15)
+	plt.ylim(bottom=0, top=600)
+	plt.tight_layout()
+	plt.show()
+	# fig.savefig("figures/network_rtt_trace.pdf", bbox_inches='tight', dpi=450)
+	fig.savefig("figures/network_rtt_trace.png", bbox_inches='tight', dpi=450)
 
-for number_participant in [10, 60]:
-	fw_owd_arr = []
-	rv_owd_arr = []
-	response_time_arr = []
-	for i in range(number_participant):
-		response_time_arr.append(int(RT)+(number_participant-i-1)*(15.0/number_participant))
-		temp_rtt_trace = generate_random_trace(latency_trace, rand_idx1[i], int(time_range*2))
-		fw_owd_arr.append([x/2 for x in temp_rtt_trace])
-		rv_owd_arr.append([x/2 for x in temp_rtt_trace])
+	store = ResultsStore(args.store)
+	results = run_sweep(latency_trace, SWEEP, time_range, g_step, args.workers, store, trace_info, args.profile)
+	store.close()
 
-	for dd in sorted(list(range(10, 360, 10))+[15]):
-		print("Running Cloudex for %d MPs, %d" % (number_participant, dd))
-		cloudex_obj = Cloudex(dd, dd)
-		cloudex_obj.set_simulation_environment(g_time, time_range, number_participant, fw_owd_arr, rv_owd_arr, response_time_arr, g_step)
-		cloudex_obj.run_simulation()
-		print_stats(cloudex_obj)
-		print_stats(cloudex_obj, output_file)
+	## Export the results of the sweep for `plot_figures.py`.
+	with open("traces/simulation.dat", "w") as output_file:
+		for result in results:
+			print(format_result(result), file=output_file)
@@ -1,6 +1,6 @@
 import numpy as np
 import argparse
-from util import read_cloud_trace, data_generation, generate_random_trace
+from util import read_cloud_trace, data_generation, get_trace_owd, variable_delay_traces, OWDTrace
 from traces.trace_indices import rand_idx1
 from algorithms.dbo import DBO
 from algorithms.cloudex import Cloudex
@@ -14,40 +14,56 @@ parser.add_argument('--delta', '-d', type=int, default=10, help='Delta for DBO (
 parser.add_argument('--batch_size', '-b', type=int, default=25, help='Batch size for DBO (in us)')
 parser.add_argument('--dd', '-dd', type=int, default=15, help='Delay threshold for Cloudex (in us)')
 parser.add_argument('--trace', '-t', type=str, default="traces/direct.zip", help='Cloud trace file to use')
+parser.add_argument('--chunk_size', '-c', type=int, default=None, help='Simulate in chunks of this many data points so that memory does not grow with the horizon')
+parser.add_argument('--workers', '-w', type=int, default=None, help='Number of worker processes simulating the participants in parallel')
+parser.add_argument('--full_trace', '-f', action='store_true', help='Simulate over the whole cloud trace, using the trace of a different MP for each participant (in chunks)')
+parser.add_argument('--synthetic', '-s', action='store_true', help='Use a synthetic random walk RTT trace for each participant instead of the cloud trace')
 
 ## Define maximum and minimum response times for MPs
 ## The response times are chosen such that the MPs are sorted in increasing order of response times.
 MAX_RT = 19
 MIN_RT = 4
+## Range of the synthetic RTTs (in us).
+SYNTHETIC_MIN_RTT = 20
+SYNTHETIC_MAX_RTT = 300
 
 g_step = 1
 time_range = 1000000
-g_time = []
-for i in range(int(time_range/g_step)):
-	g_time.append(i*g_step)
+g_time = np.arange(int(time_range/g_step))*g_step
 
 if __name__ == "__main__":
 	args = parser.parse_args()
 
-	print("Reading cloud trace file...")
-	cloud_trace = read_cloud_trace(args.trace)
-	rtt_arrs = data_generation(cloud_trace)
+	if not args.synthetic:
+		print("Reading cloud trace file...")
+		cloud_trace = read_cloud_trace(args.trace)
 
 	##   Use only a section of trace from MP1.
 	#### Use trace starting at index `trace_dd_idx`. This value was chosen randomly.
 	#### Fixed to this value to reproduce the results.
-	mp1_rtt_trace = np.array(rtt_arrs[0])
 	trace_dd_idx = 53927275
-	latency_trace = mp1_rtt_trace[trace_dd_idx-150000:trace_dd_idx+1850000]
+	if args.synthetic:
+		## Each participant has its own trace, so that the participants do not share network conditions.
+		mp_owd = list(variable_delay_traces(SYNTHETIC_MIN_RTT, SYNTHETIC_MAX_RTT, int(time_range*2), args.num_p, 0)/2)
+	elif not args.full_trace:
+		latency_trace = data_generation(cloud_trace, [1], trace_dd_idx-150000, trace_dd_idx+1850000)[0]
+		owd_trace = OWDTrace(latency_trace, int(time_range*2))
+	else:
+		## Use the delays at the data points of each MP's trace instead of a dense trace over the horizon.
+		mp_ids = sorted(cloud_trace['mp_id'].unique())
+		mp_owd = [get_trace_owd(cloud_trace, mp_ids[i % len(mp_ids)]) for i in range(args.num_p)]
+		time_range = int(min(owd.times[-1] for owd in mp_owd))
+		g_time = range(0, time_range, g_step)
 
 	fw_owd_arr = []
 	rv_owd_arr = []
 	response_time_arr = []
 	for i in range(args.num_p):
 		response_time_arr.append(int(MIN_RT)+(args.num_p-i-1)*((MAX_RT-MIN_RT)/args.num_p))
-		temp_rtt_trace = generate_random_trace(latency_trace, rand_idx1[i], int(time_range*2))
-		fw_owd_arr.append([x/2 for x in temp_rtt_trace])
-		rv_owd_arr.append([x/2 for x in temp_rtt_trace])
+		## Forward and reverse paths are symmetric and share the same view of the trace.
+		owd_window = owd_trace.get_window(rand_idx1[i]) if not (args.full_trace or args.synthetic) else mp_owd[i]
+		fw_owd_arr.append(owd_window)
+		rv_owd_arr.append(owd_window)
 
 	sim_obj = None
 	if args.algo == "dbo":
@@ -61,8 +77,12 @@ if __name__ == "__main__":
 
 	print("Running %s for %d MPs" % (sim_obj.get_title(), args.num_p))
 	print()
+	sim_obj.max_workers = args.workers
 	sim_obj.set_simulation_environment(g_time, time_range, args.num_p, fw_owd_arr, rv_owd_arr, response_time_arr, g_step)
-	sim_obj.run_simulation()
+	if args.full_trace or args.chunk_size is not None:
+		sim_obj.run_streaming_simulation(args.chunk_size)
+	else:
+		sim_obj.run_simulation()
 	print("Response Time Fairness ratio: %f" % sim_obj.get_win_fraction())
 	print("LRTF fairness ratio (delta=%f): %f" % (args.delta, sim_obj.get_lrtf_fariness_ratio(args.delta)))
 	print("Mean latency: %f us" % sim_obj.get_mean_latency())
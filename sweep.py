@@ -0,0 +1,308 @@
+import os
+import collections
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+from util import OWDTrace
+from algorithms.profiler import write_json_lines
+from results_store import get_configuration_key, format_result
+from traces.trace_indices import rand_idx1
+from algorithms.dbo import DBO
+from algorithms.cloudex import Cloudex, CloudexThresholds
+from algorithms.max_rtt import MaxRTT
+from algorithms.direct import DirectDelivery
+
+## Algorithms that can be used in a sweep, by name.
+ALGORITHMS = {
+	"DBO": DBO,
+	"Cloudex": Cloudex,
+	"MaxRTT": MaxRTT,
+	"DirectDelivery": DirectDelivery,
+}
+
+## A single simulation run of a sweep.
+##   algorithm: name of the algorithm in `ALGORITHMS`.
+##   params: arguments to construct the algorithm, e.g., (delta, batch_size, inter_batch_time) for DBO.
+##   number_participants: number of MPs.
+##   min_rt, rt_range: response times of the MPs are spread evenly over [min_rt, min_rt + rt_range).
+##   lrtf_delta: delta used to calculate the LRTF fairness ratio.
+##   trace_offsets: RB`i` uses the window of the trace starting at `trace_offsets[i]`. Defaults to `rand_idx1`.
+Configuration = collections.namedtuple("Configuration", ["algorithm", "params", "number_participants", "min_rt", "rt_range", "lrtf_delta", "trace_offsets"],
+	defaults=(None,))
+
+## State of a worker process, set up by `init_worker`.
+worker_state = {}
+
+
+def get_response_times(number_participants, min_rt, rt_range):
+	"""
+	Get the response times of the MPs. The response times are chosen such that the MPs are sorted
+	in decreasing order of response times.
+
+	Args:
+		number_participants (int): Number of MPs.
+		min_rt (float): Response time of the fastest MP.
+		rt_range (float): Range over which the response times are spread.
+
+	Returns:
+		list(float): Response times of the MPs.
+	"""
+	return [int(min_rt)+(number_participants-i-1)*(rt_range/number_participants) for i in range(number_participants)]
+
+
+def get_trace_offsets(configuration):
+	"""
+	Get the offsets of the windows of the trace used by the RBs of a configuration.
+
+	Args:
+		configuration (Configuration): Configuration to simulate.
+
+	Returns:
+		list(int): Offset of the window used by each RB.
+	"""
+	if configuration.trace_offsets is None:
+		return rand_idx1[:configuration.number_participants]
+	return list(configuration.trace_offsets[:configuration.number_participants])
+
+
+def get_stats(sim_obj, number_participants, delta):
+	"""
+	Get the results of a simulation.
+
+	Args:
+		sim_obj (Algorithm): Algorithm after running the simulation.
+		number_participants (int): Number of MPs.
+		delta (float): The delta parameter for LRTF.
+
+	Returns:
+		tuple: Title of the algorithm, number of MPs, fairness ratios and latencies (see `results_store.RESULT_COLUMNS`).
+	"""
+	return (sim_obj.get_title(),
+		number_participants,
+		float(sim_obj.get_win_fraction()),
+		float(sim_obj.get_lrtf_fariness_ratio(delta)),
+		float(sim_obj.get_mean_latency()),
+		float(sim_obj.get_99p_latency()),
+		float(sim_obj.get_max_latency()))
+
+
+def get_configuration_description(configuration, trace_info, time_range, g_step=1):
+	"""
+	Describe everything the results of a configuration depend on. This is used to identify
+	the configuration in the results store.
+
+	Args:
+		configuration (Configuration): Configuration to simulate.
+		trace_info (dict): Identifies the RTT trace, e.g., digest of the trace file and the section used.
+		time_range (int): The time horizon being simulated.
+		g_step (int, optional): The frequency at which data is generated at the CES. Defaults to 1.
+
+	Returns:
+		dict: Description of the configuration.
+	"""
+	return {
+		"title": ALGORITHMS[configuration.algorithm](*configuration.params).get_title(),
+		"params": list(configuration.params),
+		"number_participants": configuration.number_participants,
+		"response_times": get_response_times(configuration.number_participants, configuration.min_rt, configuration.rt_range),
+		"lrtf_delta": configuration.lrtf_delta,
+		"trace": trace_info,
+		"trace_offsets": get_trace_offsets(configuration),
+		"time_range": time_range,
+		"g_step": g_step,
+	}
+
+
+def get_environment(configuration, owd_trace, time_range, g_step=1):
+	"""
+	Get the simulation environment of a configuration.
+
+	Args:
+		configuration (Configuration): Configuration to simulate.
+		owd_trace (util.OWDTrace): One way delays used by the RBs (see `get_trace_offsets`).
+		time_range (int): The time horizon being simulated.
+		g_step (int, optional): The frequency at which data is generated at the CES. Defaults to 1.
+
+	Returns:
+		tuple: Arguments of `Algorithm.set_simulation_environment`.
+	"""
+	g_time = np.arange(int(time_range/g_step))*g_step
+	## Forward and reverse paths are symmetric and share the same view of the trace.
+	owd_arr = [owd_trace.get_window(offset) for offset in get_trace_offsets(configuration)]
+	response_time_arr = get_response_times(configuration.number_participants, configuration.min_rt, configuration.rt_range)
+	return g_time, time_range, configuration.number_participants, owd_arr, owd_arr, response_time_arr, g_step
+
+
+def run_configuration(configuration, owd_trace, time_range, g_step=1, profile=False):
+	"""
+	Run the simulation for a single configuration. Only the metrics are reported, so the simulation
+	runs in chunks of data points (see `Algorithm.run_streaming_simulation`), which bounds its memory
+	whatever the number of MPs and the horizon.
+
+	Args:
+		configuration (Configuration): Configuration to simulate.
+		owd_trace (util.OWDTrace): One way delays used by the RBs (see `get_trace_offsets`).
+		time_range (int): The time horizon being simulated.
+		g_step (int, optional): The frequency at which data is generated at the CES. Defaults to 1.
+		profile (bool, optional): Record the wall time and memory of each stage (see `Algorithm.profile`). Defaults to False.
+
+	Returns:
+		Algorithm: Algorithm after running the simulation.
+	"""
+	sim_obj = ALGORITHMS[configuration.algorithm](*configuration.params)
+	sim_obj.profile = profile
+	sim_obj.set_simulation_environment(*get_environment(configuration, owd_trace, time_range, g_step))
+	sim_obj.run_streaming_simulation()
+	return sim_obj
+
+
+def run_cloudex_thresholds(configurations, owd_trace, time_range, g_step=1):
+	"""
+	Run the simulations for Cloudex configurations which only differ in their thresholds in a
+	single pass (see `algorithms.cloudex.CloudexThresholds`), e.g., for a latency-fairness curve
+	outside of a sweep. Sweeps run each threshold as a job of its own (see `get_jobs`).
+
+	Args:
+		configurations (list(Configuration)): Cloudex configurations to simulate, in the same environment.
+		owd_trace (util.OWDTrace): One way delays used by the RBs (see `get_trace_offsets`).
+		time_range (int): The time horizon being simulated.
+		g_step (int, optional): The frequency at which data is generated at the CES. Defaults to 1.
+
+	Returns:
+		list(tuple): Results of each configuration (see `get_stats`), in the order of `configurations`.
+	"""
+	sim_obj = CloudexThresholds([configuration.params for configuration in configurations])
+	sim_obj.set_simulation_environment(*get_environment(configurations[0], owd_trace, time_range, g_step))
+	sim_obj.run_simulation()
+	return [get_stats(threshold_obj, configuration.number_participants, configuration.lrtf_delta)
+		for threshold_obj, configuration in zip(sim_obj.get_threshold_algorithms(), configurations)]
+
+
+def get_jobs(configurations, pending):
+	"""
+	Group configurations into jobs for the worker processes. Each configuration is a job of its own:
+	configurations are simulated in chunks of data points without a `SimulationEnvironment`, as sharing
+	the receive times through one would take memory proportional to the horizon for every MP (see
+	`Algorithm.get_chunk_r_time`), so separate jobs spread them over the workers.
+
+	Args:
+		configurations (list(Configuration)): Configurations to simulate.
+		pending (list(int)): Indices of the configurations to simulate.
+
+	Returns:
+		list(list(int)): Indices of the configurations in each job.
+	"""
+	return [[i] for i in pending]
+
+
+def init_worker(shm_name, trace_length, window_length, time_range, g_step, profile=False):
+	"""
+	Set up a worker process to use the one way delays from shared memory.
+	"""
+	shm = shared_memory.SharedMemory(name=shm_name)
+	owd = np.ndarray((trace_length + window_length - 1,), dtype=np.float64, buffer=shm.buf)
+	worker_state["shm"] = shm
+	worker_state["owd_trace"] = OWDTrace.from_buffer(owd, trace_length, window_length)
+	worker_state["time_range"] = time_range
+	worker_state["g_step"] = g_step
+	worker_state["profile"] = profile
+
+
+def create_worker_pool(owd_trace, time_range, g_step=1, max_workers=None, profile=False):
+	"""
+	Place the one way delays in shared memory and start a pool of worker processes using them
+	(see `init_worker`) to run jobs with `run_worker_job`.
+
+	Args:
+		owd_trace (util.OWDTrace): One way delays used by the RBs.
+		time_range (int): The time horizon being simulated.
+		g_step (int, optional): The frequency at which data is generated at the CES. Defaults to 1.
+		max_workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+		profile (bool, optional): Profile the stages and metrics of the simulations. Defaults to False.
+
+	Returns:
+		tuple: The pool of worker processes and the shared memory, which should be closed and unlinked
+			once the pool is shut down.
+	"""
+	shm = shared_memory.SharedMemory(create=True, size=owd_trace.owd.nbytes)
+	np.ndarray(owd_trace.owd.shape, dtype=np.float64, buffer=shm.buf)[:] = owd_trace.owd
+	init_args = (shm.name, owd_trace.trace_length, owd_trace.window_length, time_range, g_step, profile)
+	return ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=init_worker, initargs=init_args), shm
+
+
+def run_worker_job(configurations):
+	"""
+	Run the simulations for a job (see `get_jobs`) in a worker process.
+
+	Returns:
+		tuple: Results of the simulations (see `get_stats`) and, if profiling, the profiler records of the
+			stages and metrics as a list of (positions of the configurations in the job, records) (None if not profiling).
+	"""
+	args = (worker_state["owd_trace"], worker_state["time_range"], worker_state["g_step"], worker_state["profile"])
+	sim_objs = []
+	for configuration in configurations:
+		print("Running %s(%s) for %d MPs" % (configuration.algorithm, ",".join(str(x) for x in configuration.params), configuration.number_participants), flush=True)
+		sim_objs.append(run_configuration(configuration, *args))
+	profiles = [([k], sim_objs[k].profiler.records) for k in range(len(configurations))]
+	results = [get_stats(sim_objs[k], configurations[k].number_participants, configurations[k].lrtf_delta) for k in range(len(configurations))]
+	return results, profiles if worker_state["profile"] else None
+
+
+def run_sweep(latency_trace, configurations, time_range, g_step=1, max_workers=None, store=None, trace_info=None, profile_file=None):
+	"""
+	Run the simulations for all configurations in a pool of worker processes. The one way delays
+	are placed in shared memory once and used by all workers. Each configuration is a job (see `get_jobs`).
+
+	If a results store is given, configurations which already have results in the store are not
+	simulated again, and results are added to the store as soon as they are available, so an
+	interrupted sweep can be resumed.
+
+	Args:
+		latency_trace (numpy.ndarray): RTTs over time used for all RBs.
+		configurations (list(Configuration)): Configurations to simulate.
+		time_range (int): The time horizon being simulated.
+		g_step (int, optional): The frequency at which data is generated at the CES. Defaults to 1.
+		max_workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+		store (results_store.ResultsStore, optional): Store to read and write results. Defaults to None.
+		trace_info (dict, optional): Identifies `latency_trace` in the results store. Defaults to None.
+		profile_file (str, optional): If given, the stages and metrics of the simulations are profiled and
+			the records are appended to this file as JSON lines, with the configuration key, title and number
+			of MPs. Defaults to None.
+
+	Returns:
+		list(tuple): Results of the configurations (see `get_stats`), in the order of `configurations`.
+	"""
+	descriptions = [get_configuration_description(configuration, trace_info, time_range, g_step) for configuration in configurations]
+	keys = [get_configuration_key(description) for description in descriptions]
+	results = [store.get(key) if store is not None else None for key in keys]
+	pending = [i for i in range(len(configurations)) if results[i] is None]
+	if len(pending) < len(configurations):
+		print("Skipping %d configurations with results in %s" % (len(configurations) - len(pending), store.filename))
+	if len(pending) == 0:
+		return results
+
+	owd_trace = OWDTrace(latency_trace, int(time_range*2))
+	profile_file_hndlr = open(profile_file, "a") if profile_file is not None else None
+	executor, shm = create_worker_pool(owd_trace, time_range, g_step, max_workers, profile_file is not None)
+	try:
+		with executor:
+			futures = {executor.submit(run_worker_job, [configurations[i] for i in job]): job for job in get_jobs(configurations, pending)}
+			for future in as_completed(futures):
+				job = futures[future]
+				job_results, profiles = future.result()
+				for i, result in zip(job, job_results):
+					results[i] = result
+					print(format_result(results[i]), flush=True)
+					if store is not None:
+						store.put(keys[i], descriptions[i], results[i])
+				if profile_file_hndlr is not None:
+					for positions, records in profiles:
+						## Configurations simulated together share their records.
+						write_json_lines(records, profile_file_hndlr, key=",".join(keys[job[k]] for k in positions), title=",".join(descriptions[job[k]]["title"] for k in positions),
+							number_participants=descriptions[job[0]]["number_participants"])
+	finally:
+		if profile_file_hndlr is not None:
+			profile_file_hndlr.close()
+		shm.close()
+		shm.unlink()
+	return results
@@ -0,0 +1,18 @@
+import argparse
+from job_queue import read_manifest, load_latency_trace, run_queue_worker, requeue_claimed_jobs
+
+parser = argparse.ArgumentParser(description='Run the simulation jobs of a queue created by `run_simulation.py --queue`.')
+parser.add_argument('queue', type=str, help='Directory of the queue, shared by the hosts running workers')
+parser.add_argument('--workers', '-w', type=int, default=None, help='Number of worker processes on this host (defaults to the number of CPUs)')
+parser.add_argument('--trace', '-t', type=str, default="traces/direct.zip", help='Cloud trace file the queue was created with')
+parser.add_argument('--requeue', action='store_true', help='Move claimed jobs without results back to the pending jobs (only when no workers are running) and exit')
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	if args.requeue:
+		print("Requeued %d jobs" % requeue_claimed_jobs(args.queue))
+	else:
+		latency_trace = load_latency_trace(args.trace, read_manifest(args.queue)["trace"])
+		count = run_queue_worker(args.queue, latency_trace, args.workers)
+		print("Ran %d jobs; no pending jobs left in %s" % (count, args.queue))
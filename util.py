@@ -1,6 +1,10 @@
+import hashlib
+import json
+import os
 import random
 import numpy as np
 import pandas
+from algorithms.events import InterpolatedDelay
 
 
 def constant_delay(latency, time_range):
@@ -8,10 +12,7 @@ def constant_delay(latency, time_range):
 	Generate a trace of one way delays for `time_range` horizon with constant
 	transmission time for all time.
 	"""
-	answer = []
-	for i in range(time_range):
-		answer.append(latency)
-	return answer
+	return [latency]*time_range
 
 def variable_delay(min_latency, max_latency, time_range, nonce):
 	"""
@@ -39,19 +40,167 @@ def variable_delay(min_latency, max_latency, time_range, nonce):
 		answer.append(current)
 	return answer
 
-def read_cloud_trace(trace_filename="traces/direct.zip"):
+def variable_delay_steps(rng, length):
 	"""
-	Read the cloud trace from the `trace_filename`. Also calculate the end-to-end
-	latency (e2e), receive latency (receive_e2e: e2e latency minus any buffering
-	delay at the OB), delay at the OB and network RTT.
+	Draw the steps of the random walk of `variable_delay`: -0.95 (80%), 0 (15%), +1 (~4.98%) or a
+	spike of 0 to 200 (0.02%).
 
 	Args:
-		trace_filename (str, optional): Name of the trace file. Defaults to "traces/direct.zip".
+		rng (numpy.random.Generator): Random number generator.
+		length (int): Number of steps.
 
 	Returns:
-		pandas.DataFrame: Cloud trace from the file.
+		numpy.ndarray: Steps of the random walk.
+	"""
+	temp = rng.random(length)
+	step = np.where(temp < 0.8, -0.95, np.where(temp < 0.95, 0.0, 1.0))
+	spike = temp >= 0.9998
+	step[spike] = rng.integers(0, 200, np.count_nonzero(spike), endpoint=True)
+	return step
+
+def variable_delay_traces(min_latency, max_latency, time_range, number_traces, seed, chunk_size=1 << 16):
+	"""
+	Generate traces of one way delays for `time_range` horizon for several MPs at once, with the
+	same random walk with spikes as `variable_delay`. Each trace uses its own random stream spawned
+	from `seed`, so a trace does not depend on the number of traces.
+
+	A walk clamped only at `min_latency` has a closed form from the cumulative sum of the steps and
+	its running minimum. The traces are calculated in chunks of time steps with this closed form,
+	continuing from the end of the previous chunk. Clamping at `max_latency` breaks the closed form,
+	so the rest of the chunk is calculated again from the time step at which a trace reaches `max_latency`.
+	This is rare, as the walk drifts towards `min_latency`.
+
+	Args:
+		min_latency (float): Smallest one way delay, which also starts the walk.
+		max_latency (float): Largest one way delay.
+		time_range (int): The time horizon.
+		number_traces (int): Number of traces.
+		seed (int): Seed for the random number generators.
+		chunk_size (int, optional): Number of time steps calculated together. Defaults to 65536.
+
+	Returns:
+		numpy.ndarray: One way delays at each time step of the horizon, with one row for each trace.
+	"""
+	rngs = [np.random.default_rng(seed_sequence) for seed_sequence in np.random.SeedSequence(seed).spawn(number_traces)]
+	answer = np.empty((number_traces, time_range))
+	if time_range == 0:
+		return answer
+	answer[:, 0] = min_latency
+	for st in range(1, time_range, chunk_size):
+		en = min(st + chunk_size, time_range)
+		step = np.stack([variable_delay_steps(rng, en - st) for rng in rngs])
+		answer[:, st:en] = clamped_walk(answer[:, st-1], step, min_latency)
+		for k in np.flatnonzero(np.any(answer[:, st:en] > max_latency, axis=1)):
+			row = answer[k, st:en]
+			# Clamp at the first time step above `max_latency` and continue the walk from there.
+			above = np.flatnonzero(row > max_latency)
+			while len(above) > 0:
+				row[above[0]] = max_latency
+				row[above[0]+1:] = clamped_walk(row[above[0]:above[0]+1], step[k:k+1, above[0]+1:], min_latency)[0]
+				above = above[0] + 1 + np.flatnonzero(row[above[0]+1:] > max_latency)
+	return answer
+
+def clamped_walk(start, step, min_latency):
+	"""
+	Calculate random walks clamped below at `min_latency` (not above), i.e., x[t] = max(x[t-1] + step[t], min_latency).
+
+	Args:
+		start (numpy.ndarray): Value before the first step of each walk, at least `min_latency`.
+		step (numpy.ndarray): Steps of each walk, with one row for each walk.
+		min_latency (float): Smallest value of the walks.
+
+	Returns:
+		numpy.ndarray: Values of each walk after each step.
+	"""
+	# The walk is last clamped after the step at which the sum of the steps is the smallest so far:
+	# x[t] = sum[t] + max(start, min_latency - min(sum[:t+1])).
+	total = np.cumsum(step, axis=1)
+	lowest = np.minimum.accumulate(total, axis=1)
+	clamped = min_latency - lowest > start[:, None]
+	answer = total + np.where(clamped, min_latency - lowest, start[:, None])
+	## Avoid rounding errors at the time steps where the walk is clamped.
+	answer[clamped & (total == lowest)] = min_latency
+	return answer
+
+def poisson_generation_times(rate, time_range, seed):
+	"""
+	Generate the times of data points generated at the CES as a Poisson process.
+
+	Args:
+		rate (float): Mean number of data points generated per us.
+		time_range (int): The time horizon (in us).
+		seed (int): Seed for the random number generator.
+
+	Returns:
+		numpy.ndarray: Increasing generation times in [0, `time_range`).
+	"""
+	rng = np.random.default_rng(seed)
+	## Draw a few more gaps than expected so that the horizon is covered in most cases.
+	count = int(rate*time_range + 10*np.sqrt(rate*time_range) + 10)
+	g_time = np.cumsum(rng.exponential(1.0/rate, count))
+	while g_time[-1] < time_range:
+		g_time = np.concatenate([g_time, g_time[-1] + np.cumsum(rng.exponential(1.0/rate, count))])
+	return g_time[g_time < time_range]
+
+def get_trace_owd(cloud_trace, mp_id):
+	"""
+	Get the one way delays between the CES and the RB of an MP at the data points of the cloud
+	trace, without interpolating them to every time step (see `data_generation`).
+
+	Args:
+		cloud_trace (pandas.DataFrame): Cloud trace.
+		mp_id (int): MP whose trace is used.
+
+	Returns:
+		algorithms.events.InterpolatedDelay: One way delays (RTT/2) over time since the first data point of the MP.
+	"""
+	temp = cloud_trace[cloud_trace['mp_id']==mp_id]
+	x = temp['generation_time'].to_numpy()
+	return InterpolatedDelay(x - x[0], temp['rtt'].to_numpy()/2)
+
+## Columns read from the cloud trace file and their types.
+CLOUD_TRACE_DTYPES = {
+	'data_id': np.int64,
+	'generation_time': np.float64,
+	'mp_id': np.int16,
+	'response_time': np.float64,
+	'pacing_delay': np.float64,
+	'execution_time': np.float64,
+	'ces_recv_time': np.float64,
+}
+## Bump when the layout of the binary trace cache changes.
+CLOUD_TRACE_CACHE_VERSION = 1
+
+def get_file_digest(filename, block_size=1 << 20):
 	"""
-	cloud_trace = pandas.read_csv(trace_filename)
+	Get the SHA-256 digest of the contents of a file.
+
+	Args:
+		filename (str): Name of the file.
+		block_size (int, optional): Number of bytes read at once. Defaults to 1MB.
+
+	Returns:
+		str: Hex digest of the file.
+	"""
+	digest = hashlib.sha256()
+	with open(filename, 'rb') as f:
+		for block in iter(lambda: f.read(block_size), b''):
+			digest.update(block)
+	return digest.hexdigest()
+
+def get_trace_source_info(trace_filename):
+	"""
+	Get the information used to check if the binary cache of a trace file is stale.
+	"""
+	stat = os.stat(trace_filename)
+	return {'version': CLOUD_TRACE_CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def parse_cloud_trace(trace_filename):
+	"""
+	Parse the cloud trace CSV from `trace_filename` and calculate the derived columns. See
+	`read_cloud_trace`.
+	"""
+	cloud_trace = pandas.read_csv(trace_filename, usecols=list(CLOUD_TRACE_DTYPES), dtype=CLOUD_TRACE_DTYPES)
 	cloud_trace['e2e'] = (cloud_trace['execution_time'] - cloud_trace['generation_time'] - cloud_trace['response_time'])
 	cloud_trace['receive_e2e'] = (cloud_trace['ces_recv_time'] - cloud_trace['generation_time'] - cloud_trace['response_time'])
 	cloud_trace['ob_delay'] = cloud_trace['execution_time']-cloud_trace['ces_recv_time']
@@ -59,6 +208,70 @@ def read_cloud_trace(trace_filename="traces/direct.zip"):
 	cloud_trace = cloud_trace.sort_values(by='generation_time')
 	return cloud_trace
 
+def write_trace_cache(cloud_trace, cache_dir, source_info):
+	"""
+	Write the parsed cloud trace to `cache_dir` as one `.npy` file per column. The source
+	information is written last, so an interrupted write is never used.
+	"""
+	os.makedirs(cache_dir, exist_ok=True)
+	info_filename = os.path.join(cache_dir, 'source.json')
+	if os.path.exists(info_filename):
+		os.remove(info_filename)
+	np.save(os.path.join(cache_dir, 'index.npy'), cloud_trace.index.to_numpy())
+	for column in cloud_trace.columns:
+		np.save(os.path.join(cache_dir, column + '.npy'), cloud_trace[column].to_numpy())
+	with open(info_filename + '.tmp', 'w') as f:
+		json.dump(dict(source_info, columns=list(cloud_trace.columns)), f)
+	os.replace(info_filename + '.tmp', info_filename)
+
+def load_trace_cache(cache_dir, source_info):
+	"""
+	Memory-map the cloud trace from `cache_dir`.
+
+	Returns:
+		pandas.DataFrame: Cloud trace from the cache, or None if there is no cache matching `source_info`.
+	"""
+	try:
+		with open(os.path.join(cache_dir, 'source.json')) as f:
+			cache_info = json.load(f)
+	except (OSError, ValueError):
+		return None
+	columns = cache_info.pop('columns', [])
+	if cache_info != source_info:
+		return None
+	index = np.load(os.path.join(cache_dir, 'index.npy'), mmap_mode='r')
+	data = {column: np.load(os.path.join(cache_dir, column + '.npy'), mmap_mode='r') for column in columns}
+	return pandas.DataFrame(data, index=index, copy=False)
+
+def read_cloud_trace(trace_filename="traces/direct.zip", use_cache=True):
+	"""
+	Read the cloud trace from the `trace_filename`. Also calculate the end-to-end
+	latency (e2e), receive latency (receive_e2e: e2e latency minus any buffering
+	delay at the OB), delay at the OB and network RTT.
+
+	The parsed trace is cached next to the trace file in `<trace_filename>.cache` and
+	memory-mapped by later calls. The cache is rebuilt when the trace file changes.
+
+	Args:
+		trace_filename (str, optional): Name of the trace file. Defaults to "traces/direct.zip".
+		use_cache (bool, optional): Read from and write to the binary cache. Defaults to True.
+
+	Returns:
+		pandas.DataFrame: Cloud trace from the file.
+	"""
+	if not use_cache:
+		return parse_cloud_trace(trace_filename)
+	cache_dir = trace_filename + '.cache'
+	source_info = get_trace_source_info(trace_filename)
+	cloud_trace = load_trace_cache(cache_dir, source_info)
+	if cloud_trace is None:
+		cloud_trace = parse_cloud_trace(trace_filename)
+		try:
+			write_trace_cache(cloud_trace, cache_dir, source_info)
+		except OSError as e:
+			print("Could not write trace cache %s: %s" % (cache_dir, e))
+	return cloud_trace
+
 def generate_random_trace(trace_, rand_x_, time_range_):
 	"""
 	Using a list of RTTs over time and an index, generate a small snippets of RTTs of
@@ -78,41 +291,98 @@ def generate_random_trace(trace_, rand_x_, time_range_):
 		ret = np.concatenate([trace_[rand_x_:], trace_[:time_range_-(trace_.shape[0]-rand_x_)]])
 	return ret
 
-def data_generation(cloud_trace):
+class OWDTrace():
+	"""
+	One way delays derived from a single RTT trace, assuming symmetric forward and reverse
+	paths (OWD = RTT/2). Windows of the trace are served as views of one shared array, so
+	traces for many participants do not copy the data. Windows that run past the end of the
+	trace wrap around to its start (see `generate_random_trace`).
+	"""
+	def __init__(self, rtt_trace, window_length):
+		"""
+		Args:
+			rtt_trace (numpy.ndarray): Whole range of RTTs over time for a long period.
+			window_length (int): Length of the windows served.
+		"""
+		half_rtt = np.asarray(rtt_trace)/2
+		self.trace_length = len(half_rtt)
+		self.window_length = window_length
+		## Append the start of the trace (cyclically) to its end, so that every window, including
+		## those that wrap around, is a contiguous slice.
+		self.owd = np.resize(half_rtt, self.trace_length + window_length - 1)
+
+	@classmethod
+	def from_buffer(cls, owd, trace_length, window_length):
+		"""
+		Create the trace from an existing buffer of one way delays, e.g., `owd` of another
+		`OWDTrace` placed in shared memory. The buffer is used without copying.
+
+		Args:
+			owd (numpy.ndarray): One way delays of the trace followed by its first `window_length-1` delays.
+			trace_length (int): Length of the trace.
+			window_length (int): Length of the windows served.
+
+		Returns:
+			OWDTrace: Trace backed by `owd`.
+		"""
+		owd_trace = cls.__new__(cls)
+		owd_trace.trace_length = trace_length
+		owd_trace.window_length = window_length
+		owd_trace.owd = owd
+		return owd_trace
+
+	def get_window(self, start):
+		"""
+		Get the one way delays for `window_length` time steps starting at index `start`.
+
+		Args:
+			start (int): Index (expected to be randomly generated).
+
+		Returns:
+			numpy.ndarray: A read-only view of the one way delays.
+		"""
+		start = start % self.trace_length
+		window = self.owd[start:start+self.window_length]
+		window.flags.writeable = False
+		return window
+
+def data_generation(cloud_trace, mp_ids=None, start=0, end=None, chunk_size=1 << 22):
 	"""
 	Calculate the network RTTs between the CES and the RB using the cloud trace for each time step.
-	The RTT data is interpolated for the missing time steps.
+	The RTT data is linearly interpolated for the missing time steps. Index `k` of the output holds
+	the RTT at `k+1` us after the first data point of the MP.
 
 	Args:
 		cloud_trace (pandas.DataFrame): Cloud trace.
+		mp_ids (list(int), optional): MPs whose traces are used. Defaults to all MPs in the trace.
+		start (int, optional): First index of the RTT series to generate. Defaults to 0.
+		end (int, optional): Index after the last index of the RTT series to generate. Defaults to
+			the end of the trace.
+		chunk_size (int, optional): Number of time steps interpolated at once. Defaults to 4M.
 
 	Returns:
-		list(list(float)): For each RB, a list of RTTs over time between RB and CES.
+		list(numpy.ndarray): For each RB, RTTs over time between RB and CES.
 	"""
+	if mp_ids is None:
+		mp_ids = np.sort(cloud_trace.mp_id.unique())
 	rtt_arrs = []
-	## Use `np.sort(cloud_trace.mp_id.unique())` for traces from all MPs
-	# for i in np.sort(cloud_trace.mp_id.unique()):
-	for i in [1]:
+	for i in mp_ids:
 		print("Generating RTTs from trace of MP:", i)
 		temp = cloud_trace[cloud_trace['mp_id']==i]
 		x = temp['generation_time'].to_numpy()
 		y = temp['rtt'].to_numpy()
 		x = x - x[0]
-		st = 0
-		old_time_step = 0
-		rtt_arr = []
-		while True:
-			if (st+1 >= len(x)):
-				break
-			time_step = old_time_step + 1
-			while st+1<len(x) and time_step > x[st+1]:
-				st = st+1
-			if st+1>=len(x):
-				break
-			rtt = y[st]+(y[st+1]-y[st])*(time_step-x[st])/float(x[st+1]-x[st])
-			if rtt<0:
-				print(x[st], x[st+1], y[st], y[st+1], time_step)
-			rtt_arr.append(rtt)
-			old_time_step = time_step
+		## Time steps 1, 2, ... up to the last data point of the trace.
+		length = int(np.floor(x[-1])) if len(x) > 1 else 0
+		st, en = min(start, length), length if end is None else min(end, length)
+		rtt_arr = np.empty(max(en - st, 0))
+		for chunk_st in range(st, en, chunk_size):
+			time_step = np.arange(chunk_st, min(chunk_st + chunk_size, en)) + 1
+			# Interpolate between the last data point before the time step and the first one at or after it.
+			nxt = np.searchsorted(x, time_step, side='left')
+			prv = nxt - 1
+			rtt_arr[chunk_st-st:chunk_st-st+len(time_step)] = y[prv]+(y[nxt]-y[prv])*(time_step-x[prv])/(x[nxt]-x[prv]).astype(float)
+		if np.any(rtt_arr < 0):
+			print("Negative RTTs interpolated at %d time steps of MP: %s" % (np.count_nonzero(rtt_arr < 0), i))
 		rtt_arrs.append(rtt_arr)
-	return rtt_arrs
\ No newline at end of file
+	return rtt_arrs